@@ -1,29 +1,188 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import (Flask, Response, render_template, request, jsonify, session, redirect, url_for, flash, abort, g,
+                   make_response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 import os
 import json
+import math
+import base64
+import hashlib
+import io
 import ast
 import random
 import string
-from datetime import datetime
-import razorpay
+import secrets
+import threading
+from datetime import datetime, date, timedelta
+from functools import wraps
+from types import SimpleNamespace
+from sqlalchemy import and_, or_, case, cast, event, func, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import selectinload
+from werkzeug.local import LocalProxy
+from werkzeug.http import is_resource_modified
+import click
 from dotenv import load_dotenv
 
+from cache import FragmentCacheExtension, TTLCache
+import exports
+import product_import
+import search_index
+import query_audit
+from instrumentation import Instrumentation
+from payments import GatewayBusy, GatewayPool, create_client
+from passwords import HashPool, HashPoolBusy, SlidingWindowLimiter
+from session_store import create_store
+from tasks import TaskQueue
+from migrations import sync_schema
+import database
+
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'mysecretkey12345')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///shop.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool sizing for server databases (PostgreSQL, MySQL); SQLite ignores these
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=int(os.getenv('DB_POOL_SIZE', '10')),
+    max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '20')),
+    pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+    pool_recycle=int(os.getenv('DB_POOL_RECYCLE', '1800'))
+)
+# How long a SQLite connection waits for the write lock before giving up
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+# Read replica for the catalog pages; 'local' reads the primary through a read-only pool
+app.config['DATABASE_REPLICA_URL'] = database.replica_url(os.getenv('DATABASE_REPLICA_URL'),
+                                                          app.config['SQLALCHEMY_DATABASE_URI'])
+if app.config['DATABASE_REPLICA_URL']:
+    app.config['SQLALCHEMY_BINDS'] = {database.REPLICA: dict(
+        database.engine_options(app.config['DATABASE_REPLICA_URL']), url=app.config['DATABASE_REPLICA_URL'])}
+app.config['CATALOG_CACHE_SIZE'] = int(os.getenv('CATALOG_CACHE_SIZE', '1024'))
+app.config['CATALOG_CACHE_TTL'] = int(os.getenv('CATALOG_CACHE_TTL', '300'))
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.getenv('FRAGMENT_CACHE_SIZE', '512'))
+# How often each worker re-reads the catalog version written by admin edits
+app.config['CATALOG_VERSION_TTL'] = float(os.getenv('CATALOG_VERSION_TTL', '1'))
+# Cache-Control max-age for catalog pages seen by anonymous visitors
+app.config['CATALOG_MAX_AGE'] = int(os.getenv('CATALOG_MAX_AGE', '60'))
+app.config['PAGE_SIZE'] = int(os.getenv('PAGE_SIZE', '20'))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv('MAX_PAGE_SIZE', '100'))
+# Rows fetched per round trip by the streaming admin exports
+app.config['EXPORT_BATCH_SIZE'] = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+# Rows written per transaction by bulk product imports
+app.config['IMPORT_BATCH_SIZE'] = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+# Paid orders with more distinct products than this are not used for recommendations
+app.config['RECOMMENDATION_MAX_ITEMS'] = int(os.getenv('RECOMMENDATION_MAX_ITEMS', '20'))
+app.config['LOW_STOCK_THRESHOLD'] = int(os.getenv('LOW_STOCK_THRESHOLD', '10'))
+app.config['RESERVATION_TTL_MINUTES'] = int(os.getenv('RESERVATION_TTL_MINUTES', '15'))
+app.config['RAZORPAY_BASE_URL'] = os.getenv('RAZORPAY_BASE_URL')
+app.config['RAZORPAY_CONNECT_TIMEOUT'] = float(os.getenv('RAZORPAY_CONNECT_TIMEOUT', '3'))
+app.config['RAZORPAY_READ_TIMEOUT'] = float(os.getenv('RAZORPAY_READ_TIMEOUT', '10'))
+app.config['RAZORPAY_RETRIES'] = int(os.getenv('RAZORPAY_RETRIES', '2'))
+app.config['RAZORPAY_BACKOFF'] = float(os.getenv('RAZORPAY_BACKOFF', '0.5'))
+app.config['RAZORPAY_POOL_SIZE'] = int(os.getenv('RAZORPAY_POOL_SIZE', '10'))
+# Create gateway orders on a background pool and let the browser poll for them
+app.config['RAZORPAY_ASYNC'] = os.getenv('RAZORPAY_ASYNC', '1') == '1'
+app.config['RAZORPAY_WORKERS'] = int(os.getenv('RAZORPAY_WORKERS', '4'))
+app.config['RAZORPAY_MAX_PENDING'] = int(os.getenv('RAZORPAY_MAX_PENDING', '100'))
+# Carts are kept server-side; the session cookie only carries the cart key
+app.config['CART_STORE'] = os.getenv('CART_STORE',
+                                     'sqlite:///' + os.path.join(app.instance_path, 'carts.db'))
+app.config['CART_TTL_DAYS'] = int(os.getenv('CART_TTL_DAYS', '30'))
+# Durable queue for side effects that run after the response (see tasks.py)
+app.config['TASK_QUEUE_PATH'] = os.getenv('TASK_QUEUE_PATH', os.path.join(app.instance_path, 'tasks.db'))
+# Worker threads per process; 0 leaves the jobs to `flask run-tasks`
+app.config['TASK_WORKERS'] = int(os.getenv('TASK_WORKERS', '2'))
+app.config['TASK_MAX_ATTEMPTS'] = int(os.getenv('TASK_MAX_ATTEMPTS', '5'))
+app.config['TASK_RETRY_BACKOFF'] = float(os.getenv('TASK_RETRY_BACKOFF', '2'))
+# Password hashing runs in a bounded process pool; 0 workers hashes on the request thread
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_WORKERS'] = int(os.getenv('PASSWORD_WORKERS', '2'))
+app.config['PASSWORD_MAX_PENDING'] = int(os.getenv('PASSWORD_MAX_PENDING', '16'))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+# Sliding-window limits on login/register attempts per client IP and per email
+app.config['AUTH_IP_LIMIT'] = int(os.getenv('AUTH_IP_LIMIT', '20'))
+app.config['AUTH_IP_WINDOW'] = int(os.getenv('AUTH_IP_WINDOW', '60'))
+app.config['LOGIN_EMAIL_LIMIT'] = int(os.getenv('LOGIN_EMAIL_LIMIT', '5'))
+app.config['LOGIN_EMAIL_WINDOW'] = int(os.getenv('LOGIN_EMAIL_WINDOW', '300'))
+app.config['RATE_LIMIT_MAX_KEYS'] = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+# Per-endpoint request/SQL/template timings served at /metrics (off by default)
+app.config['INSTRUMENTATION'] = os.getenv('INSTRUMENTATION', '0') == '1'
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))
+# Lets a Prometheus scraper read /metrics without an admin session
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+
+db = SQLAlchemy(app, session_options={'class_': database.RoutingSession})
+
+with app.app_context():
+    for bind_key, engine in db.engines.items():
+        database.configure_sqlite(engine, busy_timeout=app.config['SQLITE_BUSY_TIMEOUT'],
+                                  synchronous=app.config['SQLITE_SYNCHRONOUS'],
+                                  read_only=bind_key == database.REPLICA)
 
-db = SQLAlchemy(app)
+# Read-through cache for catalog rows and listings, cleared on admin writes
+catalog_cache = TTLCache(maxsize=app.config['CATALOG_CACHE_SIZE'],
+                         ttl=app.config['CATALOG_CACHE_TTL'])
+# Rendered template blocks ({% cache %}), keyed by catalog version
+fragment_cache = TTLCache(maxsize=app.config['FRAGMENT_CACHE_SIZE'],
+                          ttl=app.config['CATALOG_CACHE_TTL'])
+version_cache = TTLCache(maxsize=1, ttl=app.config['CATALOG_VERSION_TTL'])
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = fragment_cache
+app.jinja_env.fragment_cache_key = lambda name: f'{get_catalog_version().version}:{name}'
+
+def lazy(factory):
+    """Proxy that builds its object on first use, so importing the app stays cheap"""
+    instance = []
+    lock = threading.Lock()
+    
+    def load():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+    
+    return LocalProxy(load)
 
 # Razorpay Setup
-razorpay_client = razorpay.Client(auth=(
+razorpay_client = lazy(lambda: create_client(
     os.getenv('RAZORPAY_KEY_ID', 'rzp_test_SCpmnAZ9GWccsN'),
-    os.getenv('RAZORPAY_KEY_SECRET', '1oNsRbN7NVSs7shL5dw4cePP')
+    os.getenv('RAZORPAY_KEY_SECRET', '1oNsRbN7NVSs7shL5dw4cePP'),
+    base_url=app.config['RAZORPAY_BASE_URL'],
+    connect_timeout=app.config['RAZORPAY_CONNECT_TIMEOUT'],
+    read_timeout=app.config['RAZORPAY_READ_TIMEOUT'],
+    retries=app.config['RAZORPAY_RETRIES'],
+    backoff=app.config['RAZORPAY_BACKOFF'],
+    pool_size=app.config['RAZORPAY_POOL_SIZE']
 ))
+cart_store = lazy(lambda: create_store(app.config['CART_STORE'],
+                                       ttl=app.config['CART_TTL_DAYS'] * 24 * 3600))
+
+gateway_pool = GatewayPool(max_workers=app.config['RAZORPAY_WORKERS'],
+                           max_pending=app.config['RAZORPAY_MAX_PENDING'])
+
+password_pool = HashPool(method=app.config['PASSWORD_HASH_METHOD'],
+                         workers=app.config['PASSWORD_WORKERS'],
+                         max_pending=app.config['PASSWORD_MAX_PENDING'],
+                         timeout=app.config['PASSWORD_HASH_TIMEOUT'])
+auth_ip_limiter = SlidingWindowLimiter(app.config['AUTH_IP_LIMIT'], app.config['AUTH_IP_WINDOW'],
+                                       maxsize=app.config['RATE_LIMIT_MAX_KEYS'])
+login_email_limiter = SlidingWindowLimiter(app.config['LOGIN_EMAIL_LIMIT'], app.config['LOGIN_EMAIL_WINDOW'],
+                                           maxsize=app.config['RATE_LIMIT_MAX_KEYS'])
+
+task_queue = TaskQueue(app.config['TASK_QUEUE_PATH'],
+                       workers=app.config['TASK_WORKERS'],
+                       max_attempts=app.config['TASK_MAX_ATTEMPTS'],
+                       backoff=app.config['TASK_RETRY_BACKOFF'],
+                       context=app.app_context)
+
+instrumentation = Instrumentation(n_plus_one_threshold=app.config['N_PLUS_ONE_THRESHOLD'])
+if app.config['INSTRUMENTATION']:
+    instrumentation.init_app(app)
 
 # Models
 class User(db.Model):
@@ -36,63 +195,490 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+CATEGORIES = ['Electronics', 'Fashion', 'Home', 'Books', 'Sports', 'Beauty']
+
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(64), unique=True)  # Supplier key used by bulk imports
     name = db.Column(db.String(100))
     description = db.Column(db.Text)
     price = db.Column(db.Float)
     discount_price = db.Column(db.Float)
+    # Derived from price and discount_price (see product_pricing) so listings
+    # can filter and sort on them in SQL
+    effective_price = db.Column(db.Float)
+    discount_percent = db.Column(db.Integer, nullable=False, default=0)
     category = db.Column(db.String(50))
     image = db.Column(db.String(500))
-    stock = db.Column(db.Integer, default=10)
+    stock = db.Column(db.Integer, default=10, index=True)
     rating = db.Column(db.Float, default=4.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Category listings and related products page through a category by id;
+    # the featured block only ever reads discounted rows. The price and
+    # discount indexes back the sorted listings, with and without a category.
+    __table_args__ = (
+        db.Index('ix_product_category_id', 'category', 'id'),
+        db.Index('ix_product_discount_price', 'discount_price'),
+        db.Index('ix_product_effective_price_id', 'effective_price', 'id'),
+        db.Index('ix_product_category_effective_price_id', 'category', 'effective_price', 'id'),
+        db.Index('ix_product_discount_percent_id', 'discount_percent', 'id'),
+        db.Index('ix_product_category_discount_percent_id', 'category', 'discount_percent', 'id'),
+    )
+
+    @db.validates('price', 'discount_price')
+    def update_pricing(self, key, value):
+        prices = {'price': self.price, 'discount_price': self.discount_price, key: value}
+        for column, derived in product_pricing(prices['price'], prices['discount_price']).items():
+            setattr(self, column, derived)
+        return value
+
+def product_pricing(price, discount_price):
+    """The stored ``effective_price`` and ``discount_percent`` for a product's prices"""
+    effective_price = discount_price if discount_price else price
+    discount_percent = 0
+    if discount_price and price:
+        discount_percent = max(0, int((1 - discount_price / price) * 100 + 0.5))
+    return {'effective_price': effective_price, 'discount_percent': discount_percent}
+
+# Listing orders for /products: (label, keyset columns, descending)
+PRODUCT_SORTS = {
+    '': ('Default', [Product.id], False),
+    'price_asc': ('Price: Low to High', [Product.effective_price, Product.id], False),
+    'price_desc': ('Price: High to Low', [Product.effective_price, Product.id], True),
+    'discount': ('Biggest Discount', [Product.discount_percent, Product.id], True),
+}
+
+# Facet buckets for the /products sidebar: [low, high) effective price ranges
+# (None for open-ended) and "N stars & up" rating bands
+PRICE_BUCKETS = [(None, 1000), (1000, 5000), (5000, 20000), (20000, 50000), (50000, None)]
+RATING_BANDS = [4, 3, 2, 1]
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.String(50), unique=True)
     user_id = db.Column(db.Integer)
     user_email = db.Column(db.String(100))
-    items = db.Column(db.Text)  # JSON string of cart items
+    items = db.Column(db.Text)  # Legacy JSON string of cart items, superseded by OrderItem
     total = db.Column(db.Float)
     payment_id = db.Column(db.String(100))
+    razorpay_order_id = db.Column(db.String(100), unique=True)
+    gateway_status = db.Column(db.String(20))  # pending / ready / failed
     status = db.Column(db.String(20), default='Pending')
+    # Stock is held for an unpaid ('Created') order until this time
+    reserved_until = db.Column(db.DateTime)
+    # Whether the order's pairs are currently counted in product_pair
+    co_purchases_recorded = db.Column(db.Boolean, default=False)
+    # Denormalized from the line items so order lists need not load them
+    item_count = db.Column(db.Integer)
+    preview = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Keyset pagination indexes: newest-first listings for admin and per user
+    __table_args__ = (
+        db.Index('ix_order_created_at_id', 'created_at', 'id'),
+        db.Index('ix_order_user_email_created_at_id', 'user_email', 'created_at', 'id'),
+        db.Index('ix_order_status_reserved_until', 'status', 'reserved_until'),
+    )
+
+    line_items = db.relationship('OrderItem', backref='order', order_by='OrderItem.id',
+                                 cascade='all, delete-orphan')
+
+    def summarize_lines(self):
+        """Fill ``item_count`` and ``preview`` from the line items"""
+        self.item_count = sum(item.quantity or 0 for item in self.line_items)
+        shown = self.line_items[:ORDER_PREVIEW_LINES]
+        preview = ', '.join(f'{item.name} ×{item.quantity}' for item in shown)
+        if len(self.line_items) > len(shown):
+            preview += f' and {len(self.line_items) - len(shown)} more'
+        self.preview = preview[:255]
+
+class OrderItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id', ondelete='CASCADE'),
+                         nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='SET NULL'), index=True)
+    name = db.Column(db.String(100))
+    price = db.Column(db.Float)
+    image = db.Column(db.String(500))
+    quantity = db.Column(db.Integer)
+    total = db.Column(db.Float)
+
+    @classmethod
+    def from_cart_item(cls, item):
+        """Build a line item from a priced cart (or legacy JSON) item dict"""
+        product_id = item.get('id')
+        return cls(
+            product_id=int(product_id) if product_id else None,
+            name=item.get('name'),
+            price=item.get('price'),
+            image=item.get('image'),
+            quantity=item.get('quantity'),
+            total=item.get('total')
+        )
+
+# Dashboard summary tables, kept current by record_order_metrics()
+class DailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class OrderStatusCount(db.Model):
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class ProductSales(db.Model):
+    product_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0, index=True)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class ProductPair(db.Model):
+    """Co-purchase matrix: paid orders containing both products, stored in both directions"""
+    product_id = db.Column(db.Integer, primary_key=True)
+    related_id = db.Column(db.Integer, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+    # "Customers also bought" reads a product's top pairs straight off this index
+    __table_args__ = (
+        db.Index('ix_product_pair_rank', 'product_id', 'orders', 'related_id'),
+    )
+
+class OrderSummary(db.Model):
+    """Per-customer order history read model, kept current by record_order_metrics()"""
+    user_email = db.Column(db.String(100), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    lifetime_spend = db.Column(db.Float, nullable=False, default=0)
+    last_order_pk = db.Column(db.Integer)
+    last_order_id = db.Column(db.String(50))
+    last_order_status = db.Column(db.String(20))
+    last_order_total = db.Column(db.Float)
+    last_order_preview = db.Column(db.String(255))
+    last_order_at = db.Column(db.DateTime)
+
+class CatalogVersion(db.Model):
+    """Single row (id 1) bumped by every catalog write; drives cache keys and ETags"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+ORDER_STATUSES = ['Pending', 'Paid', 'Shipped', 'Delivered', 'Cancelled']
+# Line items named in an order's preview before "and N more"
+ORDER_PREVIEW_LINES = 2
+# Orders in these states count towards revenue and top sellers
+REVENUE_STATUSES = ('Paid', 'Shipped', 'Delivered')
+
 # Helper functions
+def summarize_cart(cart):
+    return {'count': sum(cart.values()), 'lines': len(cart)}
+
+def cart_key(create=False):
+    """Server-side key of the current cart: per user once logged in, else per browser"""
+    if 'user_id' in session:
+        return f"user:{session['user_id']}"
+    if 'cart_id' not in session:
+        if not create:
+            return None
+        session['cart_id'] = secrets.token_urlsafe(12)
+    return f"guest:{session['cart_id']}"
+
 def get_cart():
-    return session.get('cart', {})
+    """Load the cart from the cart store, once per request"""
+    if 'cart' not in g:
+        key = cart_key()
+        cart = cart_store.get(key) if key else None
+        if cart is None and 'cart' in session:
+            # Carts from before the server-side store lived in the cookie
+            cart = session.pop('cart')
+            save_cart(cart)
+        g.cart = cart or {}
+        summary = summarize_cart(g.cart)
+        if session.get('cart_summary') != summary:
+            # The cart may have changed from another device
+            session['cart_summary'] = summary
+            g.cart_summary = summary
+    return g.cart
+
+def save_cart(cart):
+    """Store the cart together with its denormalized summary"""
+    summary = summarize_cart(cart)
+    if cart:
+        cart_store.set(cart_key(create=True), cart)
+    else:
+        key = cart_key()
+        if key:
+            cart_store.delete(key)
+    session['cart_summary'] = summary
+    g.cart = cart
+    g.cart_summary = summary
+
+def merge_guest_cart():
+    """Fold the guest cart into the account's cart after login"""
+    cart_id = session.pop('cart_id', None)
+    g.pop('cart', None)
+    g.pop('cart_summary', None)
+    if cart_id:
+        cart = cart_store.merge(f'guest:{cart_id}', cart_key())
+    else:
+        cart = cart_store.get(cart_key()) or {}
+    save_cart(cart)
+
+def get_cart_summary():
+    """Item and line counts of the cart, computed at most once per request"""
+    if 'cart_summary' not in g:
+        summary = session.get('cart_summary')
+        if summary is None:
+            # Sessions written before the summary existed
+            summary = summarize_cart(get_cart())
+        g.cart_summary = summary
+    return g.cart_summary
 
 def get_cart_count():
-    cart = get_cart()
-    return sum(cart.values())
+    return get_cart_summary()['count']
 
-def get_cart_total():
-    cart = get_cart()
-    total = 0
-    for product_id, quantity in cart.items():
-        product = Product.query.get(int(product_id))
-        if product:
-            price = product.discount_price if product.discount_price else product.price
-            total += price * quantity
-    return total
+def price_cart(cart=None):
+    """Price every cart line with a single IN (...) query.
+
+    Returns a dict with the priced ``items``, the cart ``total``, the item
+    ``count``, the loaded ``products`` keyed by id and the ``shortages`` (lines
+    whose quantity exceeds the available stock).
+    """
+    if cart is None:
+        cart = get_cart()
+
+    product_ids = [int(product_id) for product_id in cart]
+    products = {}
+    if product_ids:
+        for product in Product.query.filter(Product.id.in_(product_ids)).all():
+            products[product.id] = product
 
-def get_cart_items():
-    cart = get_cart()
     items = []
+    shortages = []
+    total = 0
     for product_id, quantity in cart.items():
-        product = Product.query.get(int(product_id))
-        if product:
-            price = product.discount_price if product.discount_price else product.price
-            items.append({
-                'id': str(product.id),
+        product = products.get(int(product_id))
+        if not product:
+            continue
+        price = product.effective_price
+        if price is None:
+            # Rows written around the ORM (raw SQL, Core inserts) may lack the derived column
+            price = product_pricing(product.price, product.discount_price)['effective_price']
+        item = {
+            'id': str(product.id),
+            'name': product.name,
+            'price': price,
+            'image': product.image,
+            'quantity': quantity,
+            'total': price * quantity
+        }
+        items.append(item)
+        total += item['total']
+        if product.stock < quantity:
+            shortages.append({
+                'id': item['id'],
                 'name': product.name,
-                'price': price,
-                'image': product.image,
                 'quantity': quantity,
-                'total': price * quantity
+                'stock': product.stock
             })
-    return items
+
+    return {
+        'items': items,
+        'total': total,
+        'count': sum(cart.values()),
+        'products': products,
+        'shortages': shortages
+    }
+
+def apply_cart_changes(changes):
+    """Apply a batch of ``{'product_id', 'quantity' or 'delta'}`` changes to the cart.
+
+    All or nothing: the cart is saved only if every change is valid and no
+    line grows past the product's stock. Returns ``(pricing, changed_ids)``
+    or ``(None, error_message)``.
+    """
+    before = get_cart()
+    cart = dict(before)
+    changed = []
+    for change in changes:
+        if not isinstance(change, dict):
+            return None, 'Each change must be a JSON object'
+        try:
+            product_id = str(int(change['product_id']))
+            if 'quantity' in change:
+                quantity = int(change['quantity'])
+            else:
+                quantity = cart.get(product_id, 0) + int(change.get('delta', 1))
+        except (KeyError, TypeError, ValueError):
+            return None, 'Each change needs an integer product_id and quantity or delta'
+        if quantity > 0:
+            cart[product_id] = quantity
+        else:
+            cart.pop(product_id, None)
+        if product_id not in changed:
+            changed.append(product_id)
+    
+    pricing = price_cart(cart)
+    for product_id in changed:
+        quantity = cart.get(product_id, 0)
+        product = pricing['products'].get(int(product_id))
+        if quantity and product is None:
+            return None, f'Product {product_id} not found'
+        if quantity > before.get(product_id, 0) and quantity > product.stock:
+            return None, f'Only {product.stock} of {product.name} in stock'
+    
+    save_cart(cart)
+    return pricing, changed
+
+# Catalog cache helpers
+def product_snapshot(product):
+    """Detached, read-only copy of a Product row that is safe to share between requests"""
+    if product is None:
+        return None
+    return SimpleNamespace(**{attr.key: getattr(product, attr.key)
+                              for attr in Product.__mapper__.column_attrs})
+
+def cached_products(key, loader):
+    """Return the product list cached under ``key``, running ``loader`` on a miss"""
+    return catalog_cache.get_or_load(key, lambda: [product_snapshot(p) for p in loader()])
+
+def get_catalog_product(product_id):
+    """Cached single-product lookup; returns None for unknown ids"""
+    return catalog_cache.get_or_load(f'product:{product_id}',
+                                     lambda: product_snapshot(Product.query.get(product_id)))
+
+def related_products(product, limit=4):
+    """Products most often bought with ``product``, topped up from its category.
+
+    Returns a namespace with the product snapshots and ``also_bought``, true
+    when any of them came from purchase history.
+    """
+    items = (Product.query.join(ProductPair, ProductPair.related_id == Product.id)
+             .filter(ProductPair.product_id == product.id, ProductPair.orders > 0)
+             .order_by(ProductPair.orders.desc(), ProductPair.related_id.desc())
+             .limit(limit)
+             .all())
+    also_bought = bool(items)
+    if len(items) < limit:
+        seen = [product.id] + [item.id for item in items]
+        items += (Product.query.filter(Product.category == product.category, Product.id.notin_(seen))
+                  .limit(limit - len(items))
+                  .all())
+    return SimpleNamespace(items=[product_snapshot(item) for item in items], also_bought=also_bought)
+
+def invalidate_catalog():
+    """Forget every cached catalog entry after an admin write.
+
+    Bumping the catalog version makes other workers drop theirs as well, and
+    changes the ETag of every catalog page.
+    """
+    bump_catalog_version()
+    catalog_cache.clear()
+    fragment_cache.clear()
+    version_cache.clear()
+
+def bump_catalog_version():
+    """Record that the catalog changed"""
+    record_catalog_change()
+    db.session.commit()
+
+def record_catalog_change():
+    """Bump the catalog version in the current transaction.
+
+    Other workers drop their catalog caches once they read the new version;
+    this one does so on its next request.
+    """
+    version_cache.clear()
+    now = datetime.utcnow()
+    updated = (CatalogVersion.query
+               .filter_by(id=1)
+               .update({CatalogVersion.version: CatalogVersion.version + 1,
+                        CatalogVersion.updated_at: now}, synchronize_session=False))
+    if not updated:
+        db.session.add(CatalogVersion(id=1, version=1, updated_at=now))
+
+def load_catalog_version():
+    row = db.session.get(CatalogVersion, 1)
+    if row is None:
+        return SimpleNamespace(version=0, updated_at=None)
+    return SimpleNamespace(version=row.version, updated_at=row.updated_at)
+
+_seen_catalog_version = [None]
+
+def get_catalog_version():
+    """Current catalog version and its timestamp, re-read every CATALOG_VERSION_TTL seconds.
+
+    A version this process has not seen means another worker changed the
+    catalog, so the local listing and fragment caches are dropped.
+    """
+    state = version_cache.get_or_load('catalog', load_catalog_version)
+    if state.version != _seen_catalog_version[0]:
+        if _seen_catalog_version[0] is not None:
+            catalog_cache.clear()
+            fragment_cache.clear()
+        _seen_catalog_version[0] = state.version
+    return state
+
+def replica_reads(view):
+    """Send the view's SELECTs to the read replica, when DATABASE_REPLICA_URL is set.
+
+    Only for views that never write, since a replica may lag behind the primary.
+    """
+    @wraps(view)
+    def wrapper(**kwargs):
+        db.session.info['use_replica'] = True
+        try:
+            return view(**kwargs)
+        finally:
+            db.session.info.pop('use_replica', None)
+    return wrapper
+
+def catalog_page(extra=None):
+    """Decorator adding ETag/Last-Modified validators to a catalog page.
+
+    The ETag covers the catalog version, the URL, the parts of base.html that
+    vary per visitor (login, admin link, cart badge) and ``extra(**view_args)``.
+    A conditional request that still matches gets a 304 before the view runs.
+    Pages for anonymous visitors with an empty cart are public so a proxy can
+    share them; everything else is private and revalidated on each visit.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # Flash messages are consumed by rendering, so never skip it
+            if session.get('_flashes'):
+                return view(**kwargs)
+            
+            version = get_catalog_version()
+            visitor = (session.get('user_id'), session.get('is_admin', False), get_cart_count())
+            public = visitor == (None, False, 0)
+            parts = (version.version, request.full_path, visitor, extra(**kwargs) if extra else None)
+            etag = hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+            
+            # A bare If-Modified-Since cannot tell one visitor's page from another's
+            if not is_resource_modified(request.environ, etag=etag,
+                                        last_modified=version.updated_at if public else None):
+                response = Response(status=304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            
+            response.set_etag(etag)
+            if version.updated_at:
+                response.last_modified = version.updated_at
+            if public:
+                response.cache_control.public = True
+                response.cache_control.max_age = app.config['CATALOG_MAX_AGE']
+            else:
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
 
 def parse_order_items(items_string):
     """Parse order items from string to Python list"""
@@ -111,6 +697,706 @@ def parse_order_items(items_string):
     except Exception:
         return []
 
+# Keyset pagination helpers
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page as an opaque URL-safe token"""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns=None):
+    """Decode a cursor back into column values; returns None if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list):
+            return None
+        if columns is None:
+            return values
+        if len(values) != len(columns):
+            return None
+        return [datetime.fromisoformat(v) if isinstance(column.type, db.DateTime) else v
+                for column, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        return None
+
+def cursor_value(column, value):
+    """``value`` as stored in a cursor. A NULL sort key becomes the lowest value
+    of the column's type, so the cursor still decodes and the next page carries
+    on past it instead of starting over."""
+    if value is not None:
+        return value
+    if isinstance(column.type, db.DateTime):
+        return datetime.min
+    if isinstance(column.type, db.String):
+        return ''
+    return 0
+
+def keyset_filter(columns, values, descending):
+    """Rows strictly after ``values`` in (columns...) order, written so the
+    leading column is a plain index range"""
+    column, value = columns[0], values[0]
+    after = column < value if descending else column > value
+    if len(columns) == 1:
+        return after
+    at_or_after = column <= value if descending else column >= value
+    return and_(at_or_after, or_(after, keyset_filter(columns[1:], values[1:], descending)))
+
+def get_page_size():
+    """Page size from ?per_page=, bounded by MAX_PAGE_SIZE"""
+    try:
+        size = int(request.args.get('per_page', app.config['PAGE_SIZE']))
+    except ValueError:
+        size = app.config['PAGE_SIZE']
+    return max(1, min(size, app.config['MAX_PAGE_SIZE']))
+
+def paginate_keyset(query, columns, cursor=None, page_size=None, descending=True):
+    """Fetch one page of ``query`` ordered by ``columns`` using keyset pagination.
+
+    The cost of a page does not depend on how deep it is, as long as an index
+    covers ``columns``. Returns a dict with ``items``, ``cursor``, ``has_next``
+    and ``next_cursor``.
+    """
+    page_size = page_size or get_page_size()
+    values = decode_cursor(cursor, columns) if cursor else None
+    if values is not None:
+        query = query.filter(keyset_filter(columns, values, descending))
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+    rows = query.limit(page_size + 1).all()
+
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = None
+    if has_next:
+        next_cursor = encode_cursor([cursor_value(c, getattr(rows[-1], c.key)) for c in columns])
+    return {
+        'items': rows,
+        'cursor': cursor if values is not None else None,
+        'has_next': has_next,
+        'next_cursor': next_cursor
+    }
+
+# Product search helpers
+_search_index_ready = False
+
+def search_index_ready():
+    """True once the FTS5 product index exists; a positive answer is remembered"""
+    global _search_index_ready
+    if not _search_index_ready:
+        _search_index_ready = search_index.is_installed(db.engine)
+    return _search_index_ready
+
+def search_condition(term):
+    """SQL condition for products matching ``term``: the FTS5 index when it is
+    installed, otherwise LIKE over name, description and category"""
+    if search_index_ready():
+        return search_index.match_condition(term)
+    pattern = f'%{term}%'
+    return or_(Product.name.ilike(pattern),
+               Product.description.ilike(pattern),
+               Product.category.ilike(pattern))
+
+def search_products(term, category, cursor, page_size, filters=None):
+    """Rank products matching ``term`` and return one page of results.
+
+    Uses the FTS5 index (prefix matching over name, description and category)
+    and falls back to LIKE on databases without FTS5. Search pages are ordered
+    by relevance, so the cursor holds an offset rather than a sort key.
+    """
+    values = decode_cursor(cursor) if cursor else None
+    offset = values[0] if values and isinstance(values[0], int) and values[0] > 0 else 0
+
+    if search_index_ready():
+        ids = search_index.search_product_ids(db.session.connection(), term, category,
+                                              limit=page_size + 1, offset=offset, **(filters or {}))
+        found = {}
+        if ids:
+            found = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()}
+        rows = [found[product_id] for product_id in ids if product_id in found]
+    else:
+        query = Product.query.filter(search_condition(term))
+        if category:
+            query = query.filter_by(category=category)
+        query = filter_products(query, **(filters or {}))
+        rows = query.order_by(Product.id).offset(offset).limit(page_size + 1).all()
+
+    has_next = len(rows) > page_size
+    return {
+        'items': [product_snapshot(p) for p in rows[:page_size]],
+        'cursor': cursor if offset else None,
+        'has_next': has_next,
+        'next_cursor': encode_cursor([offset + page_size]) if has_next else None
+    }
+
+def filter_products(query, min_price=None, max_price=None, min_rating=None, in_stock=False):
+    """Narrow ``query`` to products priced in [min_price, max_price), rated at
+    least ``min_rating`` and, if ``in_stock``, with stock left.
+
+    The upper bound is exclusive so PRICE_BUCKETS links list exactly what
+    count_facets() counted for them.
+    """
+    if min_price is not None:
+        query = query.filter(Product.effective_price >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.effective_price < max_price)
+    if min_rating is not None:
+        query = query.filter(Product.rating >= min_rating)
+    if in_stock:
+        query = query.filter(Product.stock > 0)
+    return query
+
+def get_listing_filters():
+    """Price, rating and stock filters from the query string, for filter_products().
+
+    Missing or invalid values are left out.
+    """
+    filters = {}
+    for arg in ('min_price', 'max_price', 'min_rating'):
+        try:
+            value = float(request.args.get(arg, ''))
+        except ValueError:
+            continue
+        if math.isfinite(value) and value >= 0:
+            filters[arg] = value
+    if request.args.get('in_stock'):
+        filters['in_stock'] = True
+    return filters
+
+def get_product_sort():
+    sort = request.args.get('sort', '')
+    return sort if sort in PRODUCT_SORTS else ''
+
+def load_product_page(category, search, cursor, page_size, sort='', filters=None):
+    """One cached page of the product listing.
+
+    Searches are ranked by relevance; otherwise ``sort`` picks one of
+    PRODUCT_SORTS. ``filters`` (see filter_products) apply to both.
+    """
+    filters = filters or {}
+    filters_key = ':'.join(f'{name}={value}' for name, value in sorted(filters.items()))
+    if search:
+        return catalog_cache.get_or_load(
+            f'search:{category}:{search.lower()}:{filters_key}:{cursor}:{page_size}',
+            lambda: search_products(search, category, cursor, page_size, filters))
+    
+    query = Product.query
+    if category:
+        query = query.filter_by(category=category)
+    query = filter_products(query, **filters)
+    _, columns, descending = PRODUCT_SORTS[sort]
+    
+    def load_page():
+        page = paginate_keyset(query, columns, cursor, page_size, descending=descending)
+        page['items'] = [product_snapshot(p) for p in page['items']]
+        return page
+    
+    return catalog_cache.get_or_load(f'category:{category}:{sort}:{filters_key}:{cursor}:{page_size}', load_page)
+
+def count_facets(search=''):
+    """Product counts per category, price bucket, rating band and stock status.
+
+    One grouped query over the products matching ``search`` (or the whole
+    catalog), folded into the facets here. The counts ignore the category and
+    filters currently selected, so every option shows what it would list for
+    this search. Cached until the catalog version changes.
+    """
+    def load():
+        bounds = [low for low, _ in PRICE_BUCKETS[1:]]
+        bucket = case(*[(Product.effective_price < bound, index) for index, bound in enumerate(bounds)],
+                      else_=len(bounds))
+        band = cast(func.coalesce(Product.rating, 0), db.Integer)
+        query = db.session.query(Product.category, bucket, band, Product.stock > 0, func.count(Product.id))
+        if search:
+            query = query.filter(search_condition(search))
+        rows = query.group_by(Product.category, bucket, band, Product.stock > 0).all()
+        
+        categories = dict.fromkeys(CATEGORIES, 0)
+        prices = [0] * len(PRICE_BUCKETS)
+        ratings = dict.fromkeys(RATING_BANDS, 0)
+        stock = {True: 0, False: 0}
+        for category, price_index, rating, in_stock, count in rows:
+            categories[category] = categories.get(category, 0) + count
+            prices[price_index] += count
+            for threshold in RATING_BANDS:
+                if rating >= threshold:
+                    ratings[threshold] += count
+            stock[bool(in_stock)] += count
+        return {
+            'total': sum(prices),
+            'categories': [(name, count) for name, count in categories.items() if name],
+            'prices': [(low, high, count) for (low, high), count in zip(PRICE_BUCKETS, prices)],
+            'ratings': list(ratings.items()),
+            'in_stock': stock[True],
+            'out_of_stock': stock[False],
+        }
+    
+    return catalog_cache.get_or_load(f'facets:{search.lower()}', load)
+
+def page_url(cursor=None):
+    """URL of the current listing at ``cursor``, keeping the other query args"""
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    if cursor:
+        args['cursor'] = cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+def filter_url(**changes):
+    """URL of the current listing's first page with query args replaced; None removes one"""
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    for name, value in changes.items():
+        if value is None or value == '':
+            args.pop(name, None)
+        else:
+            args[name] = value
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+# Background tasks
+def enqueue_after_commit(name, delay=0, **payload):
+    """Queue a background task once the current transaction commits; dropped on rollback"""
+    db.session.info.setdefault('pending_tasks', []).append((name, delay, payload))
+
+@event.listens_for(database.RoutingSession, 'after_commit')
+def enqueue_pending_tasks(session):
+    # The data is already committed, so a queue failure must not fail the request
+    for name, delay, payload in session.info.pop('pending_tasks', []):
+        try:
+            task_queue.enqueue(name, delay=delay, **payload)
+        except Exception:
+            app.logger.exception('Could not queue task %s %r', name, payload)
+
+@event.listens_for(database.RoutingSession, 'after_rollback')
+def drop_pending_tasks(session):
+    session.info.pop('pending_tasks', None)
+
+@task_queue.task('order_status_changed')
+def order_status_changed(order_pk):
+    """Side effects of a status change that the customer need not wait for"""
+    sync_co_purchases(order_pk)
+
+@task_queue.task('reservation_expired')
+def reservation_expired(order_pk):
+    """Release an unpaid order's stock once its hold runs out.
+
+    Queued by create_order() with a delay of RESERVATION_TTL_MINUTES; a no-op
+    if the order was paid or released in the meantime.
+    """
+    order = db.session.get(Order, order_pk)
+    if order is None or order.status != 'Created' or order.reserved_until is None:
+        return
+    remaining = (order.reserved_until - datetime.utcnow()).total_seconds()
+    if remaining > 0:
+        task_queue.enqueue('reservation_expired', delay=remaining, order_pk=order_pk)
+        return
+    release_reservation(order)
+    db.session.commit()
+
+# Dashboard metrics helpers
+# Dialects whose insert() supports ON CONFLICT ... DO UPDATE
+UPSERT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+def _increment(model, keys, **deltas):
+    """Add ``deltas`` to the summary row identified by ``keys``, creating it if needed.
+
+    One INSERT ... ON CONFLICT DO UPDATE, so two transactions creating the same
+    row at once both succeed instead of one failing on the primary key.
+    """
+    upsert = UPSERT_INSERTS.get(db.engine.dialect.name)
+    if upsert is None:
+        updated = model.query.filter_by(**keys).update(
+            {getattr(model, column): getattr(model, column) + delta for column, delta in deltas.items()},
+            synchronize_session=False)
+        if not updated:
+            db.session.add(model(**keys, **deltas))
+            db.session.flush()
+        return
+    
+    statement = upsert(model).values(**keys, **deltas)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={column: getattr(model, column) + getattr(statement.excluded, column) for column in deltas})
+    db.session.execute(statement)
+
+def record_order_metrics(order, old_status=None):
+    """Apply an order's creation (``old_status`` None) or status change to the
+    dashboard summary tables and the customer's order summary. Call it in the
+    same transaction as the order write."""
+    new_status = order.status
+    if old_status == new_status:
+        return
+
+    day = (order.created_at or datetime.utcnow()).date()
+    if old_status is None:
+        _increment(DailySales, {'day': day}, orders=1)
+    else:
+        _increment(OrderStatusCount, {'status': old_status}, count=-1)
+    _increment(OrderStatusCount, {'status': new_status}, count=1)
+
+    was_revenue = old_status in REVENUE_STATUSES
+    is_revenue = new_status in REVENUE_STATUSES
+    if was_revenue != is_revenue:
+        sign = 1 if is_revenue else -1
+        _increment(DailySales, {'day': day}, revenue=sign * order.total)
+        for item in order.line_items:
+            if item.product_id is not None:
+                _increment(ProductSales, {'product_id': item.product_id},
+                           units=sign * item.quantity, revenue=sign * item.total)
+    
+    record_order_summary(order, old_status)
+
+def record_order_summary(order, old_status=None):
+    """Apply an order's creation or status change to its customer's OrderSummary row"""
+    if not order.user_email:
+        return
+    keys = {'user_email': order.user_email}
+    spend = order.total if order.status in REVENUE_STATUSES else 0
+    if old_status is None:
+        _increment(OrderSummary, keys, order_count=1, lifetime_spend=spend)
+        # Only move "last order" forward, in case orders are recorded out of order
+        (OrderSummary.query
+         .filter_by(**keys)
+         .filter(or_(OrderSummary.last_order_at.is_(None), OrderSummary.last_order_at <= order.created_at))
+         .update({OrderSummary.last_order_pk: order.id,
+                  OrderSummary.last_order_id: order.order_id,
+                  OrderSummary.last_order_status: order.status,
+                  OrderSummary.last_order_total: order.total,
+                  OrderSummary.last_order_preview: order.preview,
+                  OrderSummary.last_order_at: order.created_at}, synchronize_session=False))
+        return
+    
+    was_revenue = old_status in REVENUE_STATUSES
+    if was_revenue != (order.status in REVENUE_STATUSES):
+        _increment(OrderSummary, keys, lifetime_spend=-order.total if was_revenue else order.total)
+    (OrderSummary.query
+     .filter_by(last_order_pk=order.id, **keys)
+     .update({OrderSummary.last_order_status: order.status}, synchronize_session=False))
+
+def co_purchased_ids(order):
+    """Distinct product ids of an order that feed the co-purchase matrix.
+
+    Orders with more than RECOMMENDATION_MAX_ITEMS products are left out: they
+    would add a quadratic number of weak pairs.
+    """
+    product_ids = sorted({item.product_id for item in order.line_items if item.product_id is not None})
+    return product_ids if len(product_ids) <= app.config['RECOMMENDATION_MAX_ITEMS'] else []
+
+def record_co_purchases(order, sign):
+    """Add (``sign`` 1) or remove (-1) one paid order's product pairs"""
+    product_ids = co_purchased_ids(order)
+    for product_id in product_ids:
+        for related_id in product_ids:
+            if related_id != product_id:
+                _increment(ProductPair, {'product_id': product_id, 'related_id': related_id}, orders=sign)
+
+def sync_co_purchases(order_pk):
+    """Count or uncount an order's pairs so product_pair matches its current status.
+
+    Safe to repeat: the conditional update of ``co_purchases_recorded`` lets
+    only one caller apply each change, however often the task runs.
+    """
+    order = db.session.get(Order, order_pk)
+    if order is None:
+        return
+    counted = order.status in REVENUE_STATUSES
+    claimed = (Order.query
+               .filter(Order.id == order.id, Order.status == order.status,
+                       Order.co_purchases_recorded.isnot(counted))
+               .update({Order.co_purchases_recorded: counted}, synchronize_session=False))
+    if claimed:
+        record_co_purchases(order, 1 if counted else -1)
+    db.session.commit()
+
+def set_order_status(order, new_status, only_from=None):
+    """Change an order's status and keep the dashboard summary in step.
+
+    Slower side effects are queued and run once the transaction commits. With
+    ``only_from`` the change is a conditional update, as in release_reservation(),
+    that applies only while the stored status is still ``only_from``; returns
+    False and changes nothing if another transaction moved the order first.
+    """
+    if only_from is None:
+        old_status = order.status
+        order.status = new_status
+    else:
+        changed = (Order.query
+                   .filter(Order.id == order.id, Order.status == only_from)
+                   .update({Order.status: new_status}, synchronize_session=False))
+        db.session.refresh(order, ['status'])
+        if not changed:
+            return False
+        old_status = only_from
+    record_order_metrics(order, old_status)
+    if old_status != new_status:
+        enqueue_after_commit('order_status_changed', order_pk=order.id)
+    return True
+
+def rebuild_dashboard_metrics():
+    """Recompute every summary table from the Order and OrderItem tables"""
+    DailySales.query.delete()
+    OrderStatusCount.query.delete()
+    ProductSales.query.delete()
+
+    is_revenue = Order.status.in_(REVENUE_STATUSES)
+    daily = (db.session.query(func.date(Order.created_at), func.count(Order.id),
+                              func.sum(case((is_revenue, Order.total), else_=0)))
+             .group_by(func.date(Order.created_at)))
+    for day, orders, revenue in daily:
+        if not isinstance(day, date):
+            day = date.fromisoformat(day)
+        db.session.add(DailySales(day=day, orders=orders, revenue=revenue or 0))
+
+    for status, count in db.session.query(Order.status, func.count(Order.id)).group_by(Order.status):
+        db.session.add(OrderStatusCount(status=status, count=count))
+
+    sellers = (db.session.query(OrderItem.product_id, func.sum(OrderItem.quantity), func.sum(OrderItem.total))
+               .join(Order, Order.id == OrderItem.order_id)
+               .filter(is_revenue, OrderItem.product_id.isnot(None))
+               .group_by(OrderItem.product_id))
+    for product_id, units, revenue in sellers:
+        db.session.add(ProductSales(product_id=product_id, units=units, revenue=revenue))
+
+    db.session.commit()
+
+def rebuild_co_purchases():
+    """Recompute the co-purchase matrix from every paid order in one statement"""
+    ProductPair.query.delete()
+
+    product_count = func.count(func.distinct(OrderItem.product_id))
+    eligible = (select(OrderItem.order_id)
+                .join(Order, Order.id == OrderItem.order_id)
+                .where(Order.status.in_(REVENUE_STATUSES), OrderItem.product_id.isnot(None))
+                .group_by(OrderItem.order_id)
+                .having(product_count.between(2, app.config['RECOMMENDATION_MAX_ITEMS'])))
+    left, right = db.aliased(OrderItem), db.aliased(OrderItem)
+    pairs = (select(left.product_id, right.product_id, func.count(func.distinct(left.order_id)))
+             .join(right, and_(right.order_id == left.order_id, right.product_id != left.product_id))
+             .where(left.order_id.in_(eligible))
+             .group_by(left.product_id, right.product_id))
+    db.session.execute(insert(ProductPair).from_select(['product_id', 'related_id', 'orders'], pairs))
+    Order.query.update({Order.co_purchases_recorded: Order.status.in_(REVENUE_STATUSES)},
+                       synchronize_session=False)
+    db.session.commit()
+
+def backfill_order_previews(batch_size=1000):
+    """Fill ``item_count`` and ``preview`` for orders created before they existed"""
+    last_id = 0
+    while True:
+        batch = (Order.query
+                 .filter(Order.id > last_id, Order.preview.is_(None))
+                 .options(selectinload(Order.line_items))
+                 .order_by(Order.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            break
+        for order in batch:
+            order.summarize_lines()
+        last_id = batch[-1].id
+        db.session.commit()
+
+def rebuild_order_summaries():
+    """Recompute every customer's OrderSummary from the Order table in one statement"""
+    OrderSummary.query.delete()
+
+    by_customer = {'partition_by': Order.user_email}
+    ranked = (select(Order.user_email, Order.id, Order.order_id, Order.status, Order.total,
+                     Order.preview, Order.created_at,
+                     func.count(Order.id).over(**by_customer).label('order_count'),
+                     func.sum(case((Order.status.in_(REVENUE_STATUSES), Order.total), else_=0))
+                     .over(**by_customer).label('lifetime_spend'),
+                     func.row_number().over(order_by=(Order.created_at.desc(), Order.id.desc()),
+                                            **by_customer).label('recency'))
+              .where(Order.user_email.isnot(None))
+              .subquery())
+    latest = select(ranked.c.user_email, ranked.c.order_count, func.coalesce(ranked.c.lifetime_spend, 0),
+                    ranked.c.id, ranked.c.order_id, ranked.c.status, ranked.c.total,
+                    ranked.c.preview, ranked.c.created_at).where(ranked.c.recency == 1)
+    db.session.execute(insert(OrderSummary).from_select(
+        ['user_email', 'order_count', 'lifetime_spend', 'last_order_pk', 'last_order_id',
+         'last_order_status', 'last_order_total', 'last_order_preview', 'last_order_at'], latest))
+    db.session.commit()
+
+def backfill_product_pricing():
+    """Fill ``effective_price`` and ``discount_percent`` for every product in one UPDATE,
+    with the same rounding as product_pricing()"""
+    discounted = and_(Product.discount_price.isnot(None), Product.discount_price != 0)
+    percent = cast((1 - Product.discount_price / Product.price) * 100 + 0.5, db.Integer)
+    Product.query.update({
+        Product.effective_price: case((discounted, Product.discount_price), else_=Product.price),
+        Product.discount_percent: case((and_(discounted, Product.price != 0, percent > 0), percent), else_=0),
+    }, synchronize_session=False)
+    db.session.commit()
+
+def get_dashboard_metrics(days=14, top=5):
+    """Read the dashboard figures from the summary tables"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    status_counts = {row.status: row.count
+                     for row in OrderStatusCount.query.filter(OrderStatusCount.count > 0)
+                                                      .order_by(OrderStatusCount.status)}
+    top_sellers = (db.session.query(ProductSales, Product.name)
+                   .outerjoin(Product, Product.id == ProductSales.product_id)
+                   .filter(ProductSales.units > 0)
+                   .order_by(ProductSales.units.desc())
+                   .limit(top)
+                   .all())
+    return {
+        'total_orders': sum(status_counts.values()),
+        'total_revenue': db.session.query(func.coalesce(func.sum(DailySales.revenue), 0)).scalar(),
+        'daily_sales': DailySales.query.filter(DailySales.day >= since).order_by(DailySales.day.desc()).all(),
+        'status_counts': status_counts,
+        'top_sellers': [{'product_id': sales.product_id, 'name': name or f'Product #{sales.product_id}',
+                         'units': sales.units, 'revenue': sales.revenue}
+                        for sales, name in top_sellers],
+        'low_stock': (Product.query.filter(Product.stock <= app.config['LOW_STOCK_THRESHOLD'])
+                      .order_by(Product.stock).limit(10).all())
+    }
+
+# Stock reservation helpers
+def reserve_stock(lines):
+    """Atomically take stock for ``(product_id, quantity)`` lines in the current transaction.
+
+    Each line is a conditional ``UPDATE ... SET stock = stock - q WHERE stock >= q``,
+    so concurrent checkouts can never drive stock negative. Lines are applied in
+    product id order to keep lock ordering consistent across workers. Returns the
+    product id of the first line that could not be reserved, or None on success;
+    the caller must roll back on failure.
+    """
+    for product_id, quantity in sorted(lines):
+        reserved = (Product.query
+                    .filter(Product.id == product_id, Product.stock >= quantity)
+                    .update({Product.stock: Product.stock - quantity}, synchronize_session=False))
+        if not reserved:
+            return product_id
+    # Selling out changes listings, facet counts and ETags in every worker,
+    # not just the product entries the caller invalidates here
+    if sold_out([product_id for product_id, _ in lines]):
+        record_catalog_change()
+    return None
+
+def sold_out(product_ids):
+    """True if any of ``product_ids`` has no stock left"""
+    return db.session.query(Product.id).filter(Product.id.in_(product_ids), Product.stock <= 0).first() is not None
+
+def order_stock_lines(order):
+    return [(item.product_id, item.quantity) for item in order.line_items if item.product_id is not None]
+
+def release_reservation(order, status='Cancelled'):
+    """Cancel an unpaid order and put its reserved stock back.
+
+    The status flip is itself conditional on the order still being 'Created', so
+    a reservation is released exactly once even if a timeout sweep and a payment
+    failure race. Returns True if this call released it.
+    """
+    released = (Order.query
+                .filter(Order.id == order.id, Order.status == 'Created')
+                .update({Order.status: status, Order.reserved_until: None}, synchronize_session=False))
+    if not released:
+        return False
+
+    lines = order_stock_lines(order)
+    restocked = sold_out([product_id for product_id, _ in lines])
+    for product_id, quantity in sorted(lines):
+        (Product.query
+         .filter(Product.id == product_id)
+         .update({Product.stock: Product.stock + quantity}, synchronize_session=False))
+    if restocked:
+        record_catalog_change()
+
+    db.session.refresh(order, ['status', 'reserved_until'])
+    record_order_metrics(order, 'Created')
+    catalog_cache.invalidate('admin:products', *[f'product:{product_id}' for product_id, _ in lines])
+    return True
+
+def release_expired_reservations(limit=100):
+    """Release up to ``limit`` reservations whose hold has run out; returns how many"""
+    expired = (Order.query
+               .filter(Order.status == 'Created', Order.reserved_until < datetime.utcnow())
+               .order_by(Order.reserved_until)
+               .limit(limit)
+               .all())
+    released = 0
+    for order in expired:
+        if release_reservation(order):
+            released += 1
+        db.session.commit()
+    return released
+
+# Payment gateway helpers
+def payment_options(order, user):
+    """Checkout options for an order whose Razorpay order has been created"""
+    return {
+        'success': True,
+        'order_id': order.razorpay_order_id,
+        'amount': order.total * 100,
+        'currency': 'INR',
+        'key': os.getenv('RAZORPAY_KEY_ID'),
+        'name': 'Modern Shop',
+        'description': 'Order Payment',
+        'receipt': order.order_id,
+        'user': {
+            'name': user.name,
+            'email': user.email,
+            'phone': user.phone or '9999999999'
+        }
+    }
+
+def open_gateway_order(order):
+    """Create the Razorpay order for ``order`` and record the outcome.
+
+    On failure the order's stock reservation is released. Returns None on
+    success or the gateway error message.
+    """
+    try:
+        razorpay_order = razorpay_client.order.create({
+            'amount': int(order.total * 100),  # Convert to paise
+            'currency': 'INR',
+            'payment_capture': 1,
+            'receipt': order.order_id
+        })
+    except Exception as e:
+        app.logger.warning('Razorpay order creation failed for %s: %s', order.order_id, e)
+        # The customer cannot pay for this order, so give its stock back
+        db.session.rollback()
+        release_reservation(order)
+        order.gateway_status = 'failed'
+        db.session.commit()
+        return str(e)
+    
+    order.razorpay_order_id = razorpay_order['id']
+    order.gateway_status = 'ready'
+    db.session.commit()
+    return None
+
+def open_gateway_order_async(order_pk):
+    """Gateway pool entry point: runs open_gateway_order in its own app context"""
+    with app.app_context():
+        order = db.session.get(Order, order_pk)
+        if order is not None:
+            open_gateway_order(order)
+
+def gateway_pending_response(order):
+    return jsonify({
+        'success': True,
+        'pending': True,
+        'receipt': order.order_id,
+        'status_url': url_for('api_order_status', order_id=order.order_id)
+    })
+
+def auth_refused(template, message, status, retry_after):
+    """Re-render a login/register form with an error and a Retry-After header"""
+    flash(message, 'error')
+    response = make_response(render_template(template), status)
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response
+
+def rate_limited(template, *checks):
+    """Count an attempt against each ``(limiter, key)``; a refusal response if any is over"""
+    for limiter, key in checks:
+        if not limiter.hit(key):
+            wait = limiter.retry_after(key)
+            return auth_refused(template, f'Too many attempts. Please try again in {int(wait + 0.999)} seconds.',
+                                429, wait)
+    return None
+
 def is_logged_in():
     return 'user_id' in session
 
@@ -121,14 +1407,10 @@ def generate_order_id():
     """Generate unique order ID"""
     return 'ORD' + ''.join(random.choices(string.digits, k=10))
 
-# Initialize database with sample data
-def init_database():
-    with app.app_context():
-        # Drop all tables and recreate (for development)
-        db.drop_all()
-        db.create_all()
-        
-        # Create admin user
+# Database bootstrap: run from the CLI (flask init-db / seed), never on import
+def seed_database():
+    """Add the admin user and sample products if they are missing"""
+    if not User.query.filter_by(email='admin@shop.com').first():
         admin = User(
             name='Admin',
             email='admin@shop.com',
@@ -138,7 +1420,8 @@ def init_database():
         )
         db.session.add(admin)
         print("✅ Admin user created: admin@shop.com / admin123")
-        
+    
+    if Product.query.first() is None:
         # Add sample products
         sample_products = [
             Product(
@@ -220,12 +1503,314 @@ def init_database():
         ]
         db.session.add_all(sample_products)
         print("✅ 8 sample products added")
-        
+    
+    db.session.commit()
+
+def drop_database():
+    """Drop every table, including the search index (development only)"""
+    search_index.drop(db.engine)
+    db.drop_all()
+
+def migrate_database():
+    """Bring the schema up to date and run pending data migrations.
+
+    Idempotent: tables, columns and indexes are only created when missing, and
+    each data migration is recorded in schema_migration and runs once.
+    """
+    for change in sync_schema(db.engine, db.metadata):
+        print(f"✅ Created {change}")
+    
+    applied = {row.version for row in SchemaMigration.query.all()}
+    for version, migrate in DATA_MIGRATIONS:
+        if version in applied:
+            continue
+        migrate()
+        db.session.add(SchemaMigration(version=version))
+        db.session.commit()
+        print(f"✅ Applied {version}")
+
+def backfill_order_items(batch_size=1000):
+    """Create OrderItem rows for orders that only have the legacy JSON blob.
+
+    Safe to run repeatedly: orders that already have line items are skipped.
+    Returns the number of orders migrated.
+    """
+    migrated = 0
+    last_id = 0
+    while True:
+        batch = (Order.query
+                 .filter(Order.id > last_id, Order.items.isnot(None), ~Order.line_items.any())
+                 .order_by(Order.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            break
+        for order in batch:
+            for item in parse_order_items(order.items):
+                if isinstance(item, dict):
+                    order.line_items.append(OrderItem.from_cart_item(item))
+            migrated += 1
+        last_id = batch[-1].id
         db.session.commit()
-        print("✅ Database initialized successfully!")
+    return migrated
+
+# One-off data migrations, applied in order by migrate_database()
+DATA_MIGRATIONS = [
+    ('0001_product_search_index', lambda: search_index.install(db.engine)),
+    ('0002_backfill_order_items', backfill_order_items),
+    ('0003_dashboard_metrics', lambda: rebuild_dashboard_metrics()),
+    ('0004_catalog_version', lambda: bump_catalog_version()),
+    ('0005_co_purchases', lambda: rebuild_co_purchases()),
+    ('0006_co_purchase_flags', lambda: rebuild_co_purchases()),
+    ('0007_order_summaries', lambda: (backfill_order_previews(), rebuild_order_summaries())),
+    ('0008_product_pricing', lambda: backfill_product_pricing()),
+]
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the schema without touching existing data"""
+    migrate_database()
+    print("✅ Database is up to date")
+
+@app.cli.command('seed')
+def seed_command():
+    """Add the admin user and sample products if missing"""
+    seed_database()
+    print("✅ Sample data ready")
+
+@app.cli.command('reset-db')
+@click.confirmation_option(prompt='This deletes all data. Continue?')
+def reset_db_command():
+    """Drop everything, recreate the schema and load sample data"""
+    drop_database()
+    migrate_database()
+    seed_database()
+    print("✅ Database reset")
+
+@app.cli.command('backfill-order-items')
+def backfill_order_items_command():
+    """Migrate legacy Order.items JSON into the order_item table"""
+    print(f"✅ Backfilled line items for {backfill_order_items()} orders")
+
+@app.cli.command('rebuild-dashboard-metrics')
+def rebuild_dashboard_metrics_command():
+    """Recompute the dashboard summary tables from order history"""
+    rebuild_dashboard_metrics()
+    print("✅ Dashboard metrics rebuilt")
+
+@app.cli.command('rebuild-recommendations')
+def rebuild_recommendations_command():
+    """Recompute the "customers also bought" matrix from order history"""
+    rebuild_co_purchases()
+    print(f"✅ Co-purchase matrix rebuilt ({ProductPair.query.count()} pairs)")
+
+@app.cli.command('rebuild-order-summaries')
+def rebuild_order_summaries_command():
+    """Recompute the per-customer order summaries from order history"""
+    backfill_order_previews()
+    rebuild_order_summaries()
+    print(f"✅ Order summaries rebuilt ({OrderSummary.query.count()} customers)")
+
+@app.cli.command('run-tasks')
+@click.option('--retry-failed', is_flag=True, help='Give failed tasks a fresh set of attempts first')
+def run_tasks_command(retry_failed):
+    """Run every due background task in this process, then report the queue"""
+    if retry_failed:
+        print(f"🔁 Requeued {task_queue.retry_failed()} failed tasks")
+    print(f"✅ Ran {task_queue.run_pending()} tasks")
+    stats = task_queue.stats()
+    print(f"   {stats['due']} due, {stats['scheduled']} scheduled, {stats['failed']} failed")
+    for task in task_queue.failed(limit=10):
+        print(f"❌ #{task['id']} {task['name']} {task['payload']}: {task['error']}")
 
-# Initialize database on startup
-init_database()
+@app.cli.command('release-expired-reservations')
+def release_expired_reservations_command():
+    """Cancel unpaid orders whose stock hold has expired.
+
+    The reservation_expired task normally does this on time; the sweep catches
+    any hold whose task was lost.
+    """
+    total = 0
+    while True:
+        released = release_expired_reservations()
+        total += released
+        if not released:
+            break
+    print(f"✅ Released {total} expired reservations")
+
+@app.cli.command('sweep-carts')
+def sweep_carts_command():
+    """Delete carts that have not been touched for CART_TTL_DAYS"""
+    print(f"✅ Removed {cart_store.sweep()} expired carts")
+
+def import_products(stream, fmt, batch_size=None, dry_run=False):
+    """Validate and upsert products (keyed by sku) from a CSV or JSON Lines text stream.
+
+    Rows are written in batches, one transaction and one executemany per
+    batch. The search index triggers stay active, so every row is searchable
+    as soon as its batch commits; the catalog caches are refreshed once at the
+    end. Returns an ImportReport; with ``dry_run`` nothing is written.
+    """
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    report = product_import.ImportReport()
+    batch = {}
+    
+    def flush():
+        if not batch:
+            return
+        existing = {row.sku: row for row in db.session.execute(
+            select(Product.sku, Product.id, Product.discount_price).where(Product.sku.in_(list(batch))))}
+        inserts, updates = [], []
+        for sku, (line, values) in batch.items():
+            current = existing.get(sku)
+            if current is None:
+                values = dict(product_import.DEFAULTS, **values)
+            else:
+                # Only the supplied columns change; keep the stored discount if the file has none
+                values = dict(values, id=current.id)
+            discount_price = values['discount_price'] if 'discount_price' in values else current.discount_price
+            if discount_price and discount_price >= values['price']:
+                report.error(line, f"price must be above the current discount_price {discount_price:g}")
+                continue
+            # Bulk statements bypass Product.update_pricing, so add the derived columns here
+            values.update(product_pricing(values['price'], discount_price))
+            (inserts if current is None else updates).append(values)
+        try:
+            if not dry_run:
+                if inserts:
+                    db.session.execute(insert(Product), inserts)
+                if updates:
+                    db.session.execute(update(Product), updates)
+                db.session.commit()
+            report.inserted += len(inserts)
+            report.updated += len(updates)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            lines = [line for line, _ in batch.values()]
+            report.error(min(lines), f'Batch of lines {min(lines)}-{max(lines)} was not saved: {e.orig or e}',
+                         rows=len(inserts) + len(updates))
+        batch.clear()
+    
+    for line, record, error in product_import.read_rows(stream, fmt):
+        if record is not None:
+            values, error = product_import.validate_row(record, CATEGORIES)
+        if error:
+            report.error(line, error)
+            continue
+        # A sku repeated in the file: the last row wins
+        batch[values['sku']] = (line, values)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    
+    if report.imported and not dry_run:
+        invalidate_catalog()
+    return report
+
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(product_import.FORMATS),
+              help='Defaults to the file extension')
+@click.option('--batch-size', type=int, help='Rows per transaction (IMPORT_BATCH_SIZE)')
+@click.option('--dry-run', is_flag=True, help='Validate only; write nothing')
+def import_products_command(path, fmt, batch_size, dry_run):
+    """Add or update products from a CSV or JSON Lines file, matched by sku"""
+    fmt = fmt or product_import.detect_format(path)
+    if fmt is None:
+        raise click.UsageError('Cannot tell the format from the file name; pass --format')
+    
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        report = import_products(stream, fmt, batch_size=batch_size, dry_run=dry_run)
+    
+    for line, message in report.errors:
+        print(f"❌ Line {line}: {message}")
+    if report.failed > len(report.errors):
+        print(f"... and {report.failed - len(report.errors)} more")
+    print(f"{'✅' if not report.failed else '⚠️'} {'Dry run: ' if dry_run else ''}{report.summary()}")
+    if report.failed:
+        raise SystemExit(1)
+
+def audit_routes():
+    """(url, session user, tables that may be scanned) for each page the audit visits.
+
+    Pages for a single product or order are skipped when there is none to show.
+    """
+    product = Product.query.order_by(Product.id).first()
+    order = Order.query.order_by(Order.id).first()
+    admin = User.query.filter_by(is_admin=True).first()
+    customer = User.query.filter_by(email=order.user_email).first() if order else None
+    customer = customer or admin
+    category = product.category if product else 'Electronics'
+    word = (product.name.split() or ['shop'])[0] if product else 'shop'
+    routes = [
+        ('/', None, ()),
+        # The facet counts group the whole catalog once per catalog version;
+        # the listing queries on these pages are audited through the API below
+        ('/products', None, ('product',)),
+        (f'/products?category={category}', None, ('product',)),
+        (f'/products?search={word}', None, ()),
+        ('/cart', customer, ()),
+        ('/profile', customer, ()),
+        ('/orders', customer, ()),
+        ('/api/v1/products', None, ()),
+        (f'/api/v1/products?category={category}', None, ()),
+        ('/api/v1/products?sort=price_desc', None, ()),
+        (f'/api/v1/products?category={category}&sort=discount', None, ()),
+        (f'/api/v1/products?category={category}&sort=price_asc&min_price=100&max_price=100000', None, ()),
+        ('/api/v1/cart', customer, ()),
+        ('/api/v1/orders', customer, ()),
+        # Whole-table reads on purpose: counts, the full product list and the
+        # small summary tables
+        ('/admin', admin, ('product', 'user', 'order_status_count', 'daily_sales')),
+        ('/admin/products', admin, ('product',)),
+        ('/admin/orders', admin, ()),
+    ]
+    if product:
+        routes.append((f'/product/{product.id}', None, ()))
+    if order:
+        order_cursor = encode_cursor([order.created_at, order.id])
+        routes += [
+            (f'/orders?cursor={order_cursor}', customer, ()),
+            (f'/order/{order.order_id}', customer, ()),
+            (f'/api/order-status/{order.order_id}', customer, ()),
+            (f'/admin/orders?cursor={order_cursor}', admin, ()),
+        ]
+    return routes
+
+@app.cli.command('audit-queries')
+@click.option('--verbose', '-v', is_flag=True, help='Print the plan of every query, not just flagged ones')
+def audit_queries_command(verbose):
+    """Run each page's queries through EXPLAIN QUERY PLAN and flag full table scans"""
+    if db.engine.dialect.name != 'sqlite':
+        print("⚠️ The query audit needs an SQLite database")
+        raise SystemExit(1)
+
+    client = app.test_client()
+    flagged_total = 0
+    for url, user, allow in audit_routes():
+        with client.session_transaction() as sess:
+            sess.clear()
+            if user:
+                sess.update(user_id=user.id, user_name=user.name,
+                            user_email=user.email, is_admin=user.is_admin)
+        catalog_cache.clear()
+        with query_audit.capture_statements(db.engine) as statements:
+            client.get(url)
+
+        results = query_audit.audit_statements(db.engine, statements, allow)
+        flagged = [result for result in results if result[2]]
+        flagged_total += len(flagged)
+        print(f"{'❌' if flagged else '✅'} {url}: {len(results)} queries, {len(flagged)} flagged")
+        for statement, plan, issues in results:
+            if issues or verbose:
+                print(f"    {' '.join(statement.split())}")
+                for detail in plan:
+                    print(f"      {'!!' if detail in issues else '  '} {detail}")
+
+    if flagged_total:
+        print(f"❌ {flagged_total} queries read whole tables")
+        raise SystemExit(1)
+    print("✅ Every query uses an index")
 
 # Custom Jinja2 filters
 @app.template_filter('from_json')
@@ -240,10 +1825,8 @@ def format_price_filter(price):
 
 @app.template_filter('calculate_discount')
 def calculate_discount_filter(original, discounted):
-    """Calculate discount percentage"""
-    if not discounted:
-        return 0
-    return int(((original - discounted) / original) * 100)
+    """Calculate discount percentage, rounded like the stored discount_percent"""
+    return product_pricing(original, discounted)['discount_percent']
 
 # Context processor for template variables - FIXED
 @app.context_processor
@@ -254,45 +1837,60 @@ def inject_utilities():
         'is_logged_in': is_logged_in,
         'is_admin': is_admin,
         'get_cart_count': get_cart_count,
-        'cart_count': get_cart_count()  # This is the fix - call the function
+        'get_cart_summary': get_cart_summary,
+        'page_url': page_url,
+        'filter_url': filter_url
     }
 
 # Routes
 @app.route('/')
+@replica_reads
+@catalog_page()
 def home():
-    products = Product.query.limit(8).all()
-    featured = Product.query.filter(Product.discount_price.isnot(None)).limit(4).all()
+    products = cached_products('home:grid', lambda: Product.query.limit(8).all())
+    featured = cached_products('home:featured',
+                               lambda: Product.query.filter(Product.discount_price > 0).limit(4).all())
     return render_template('home.html', 
                          products=products, 
                          featured=featured)
 
 @app.route('/products')
+@replica_reads
+@catalog_page()
 def products():
     category = request.args.get('category', '')
     search = request.args.get('search', '')
     
-    query = Product.query
+    sort = get_product_sort()
+    filters = get_listing_filters()
+    cursor = request.args.get('cursor')
+    page_size = get_page_size()
     
-    if category:
-        query = query.filter_by(category=category)
-    if search:
-        query = query.filter(Product.name.contains(search))
-    
-    products = query.all()
-    categories = ['Electronics', 'Fashion', 'Home', 'Books', 'Sports', 'Beauty']
+    page = load_product_page(category, search, cursor, page_size, sort, filters)
     
     return render_template('products.html', 
-                         products=products,
-                         categories=categories,
-                         selected_category=category)
+                         products=page['items'],
+                         page=page,
+                         search=search,
+                         categories=CATEGORIES,
+                         facets=count_facets(search),
+                         selected_category=category,
+                         sorts=PRODUCT_SORTS,
+                         selected_sort=sort,
+                         filters=filters)
 
 @app.route('/product/<int:id>')
+@replica_reads
+@catalog_page(extra=lambda id: getattr(get_catalog_product(id), 'stock', None))
 def product_detail(id):
-    product = Product.query.get_or_404(id)
-    related = Product.query.filter(Product.category == product.category, Product.id != id).limit(4).all()
+    product = get_catalog_product(id)
+    if product is None:
+        abort(404)
+    related = catalog_cache.get_or_load(f'related:{id}', lambda: related_products(product))
     return render_template('products/product_detail.html', 
                          product=product, 
-                         related=related)
+                         related=related.items,
+                         also_bought=related.also_bought)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -300,6 +1898,10 @@ def register():
         return redirect('/')
     
     if request.method == 'POST':
+        refused = rate_limited('register.html', (auth_ip_limiter, request.remote_addr))
+        if refused:
+            return refused
+        
         name = request.form.get('name', '').strip()
         email = request.form.get('email', '').strip().lower()
         password = request.form.get('password', '')
@@ -326,9 +1928,13 @@ def register():
             flash('Password must be at least 6 characters long', 'error')
             return redirect('/register')
         
+        try:
+            hashed_password = password_pool.hash(password)
+        except HashPoolBusy:
+            return auth_refused('register.html', 'The server is busy. Please try again in a moment.', 503, 1)
+        
         # Create new user
         try:
-            hashed_password = generate_password_hash(password)
             user = User(
                 name=name,
                 email=email,
@@ -363,13 +1969,30 @@ def login():
             flash('Please enter email and password', 'error')
             return redirect('/login')
         
+        refused = rate_limited('login.html', (auth_ip_limiter, request.remote_addr),
+                               (login_email_limiter, email))
+        if refused:
+            return refused
+        
         user = User.query.filter_by(email=email).first()
+        valid = False
+        if user:
+            try:
+                valid, new_hash = password_pool.verify(user.password, password)
+            except HashPoolBusy:
+                return auth_refused('login.html', 'The server is busy. Please try again in a moment.', 503, 1)
+            if new_hash:
+                # Stored with older hash settings; upgrade now that we know the password
+                user.password = new_hash
+                db.session.commit()
         
-        if user and check_password_hash(user.password, password):
+        if valid:
+            login_email_limiter.reset(email)
             session['user_id'] = user.id
             session['user_name'] = user.name
             session['user_email'] = user.email
             session['is_admin'] = user.is_admin
+            merge_guest_cart()
             
             flash(f'Welcome back, {user.name}!', 'success')
             return redirect('/')
@@ -390,15 +2013,16 @@ def profile():
         return redirect('/login')
     
     user = User.query.get(session['user_id'])
-    orders = Order.query.filter_by(user_email=user.email).order_by(Order.created_at.desc()).all()
-    
-    # Parse order items for each order
-    for order in orders:
-        order.parsed_items = parse_order_items(order.items)
+    summary = db.session.get(OrderSummary, user.email)
+    page = paginate_keyset(Order.query.filter_by(user_email=user.email),
+                           [Order.created_at, Order.id], request.args.get('cursor'))
+    orders = page['items']
     
     return render_template('profile.html', 
                          user=user, 
-                         orders=orders)
+                         summary=summary,
+                         orders=orders,
+                         page=page)
 
 @app.route('/add-to-cart/<int:product_id>')
 def add_to_cart(product_id):
@@ -418,18 +2042,17 @@ def add_to_cart(product_id):
         flash(f'Only {product.stock} items available in stock', 'error')
     else:
         cart[str(product_id)] = current_qty + 1
-        session['cart'] = cart
+        save_cart(cart)
         flash('Product added to cart!', 'success')
     
     return redirect(request.referrer or '/')
 
 @app.route('/cart')
 def cart():
-    items = get_cart_items()
-    total = get_cart_total()
+    pricing = price_cart()
     return render_template('cart.html', 
-                         items=items, 
-                         total=total)
+                         items=pricing['items'], 
+                         total=pricing['total'])
 
 @app.route('/update-cart', methods=['POST'])
 def update_cart():
@@ -442,35 +2065,19 @@ def update_cart():
     if not product_id or not action:
         return jsonify({'success': False, 'message': 'Invalid request'})
     
-    cart = get_cart()
-    
-    if action == 'increase':
-        product = Product.query.get(int(product_id))
-        if product and cart.get(product_id, 0) < product.stock:
-            cart[product_id] = cart.get(product_id, 0) + 1
-        else:
-            return jsonify({'success': False, 'message': 'Product out of stock'})
-    elif action == 'decrease':
-        if cart.get(product_id, 0) > 1:
-            cart[product_id] -= 1
-        else:
-            cart.pop(product_id, None)
-    elif action == 'remove':
-        cart.pop(product_id, None)
-    else:
+    change = {'increase': {'delta': 1}, 'decrease': {'delta': -1}, 'remove': {'quantity': 0}}.get(action)
+    if change is None:
         return jsonify({'success': False, 'message': 'Invalid action'})
     
-    session['cart'] = cart
-    
-    # Calculate new totals
-    items = get_cart_items()
-    total = get_cart_total()
+    pricing, changed = apply_cart_changes([dict(change, product_id=product_id)])
+    if pricing is None:
+        return jsonify({'success': False, 'message': changed})
     
     return jsonify({
         'success': True,
-        'cart_count': get_cart_count(),
-        'cart_total': total,
-        'items': items
+        'cart_count': pricing['count'],
+        'cart_total': pricing['total'],
+        'items': pricing['items']
     })
 
 @app.route('/checkout')
@@ -479,19 +2086,19 @@ def checkout():
         flash('Please login to checkout', 'error')
         return redirect('/login')
     
-    items = get_cart_items()
+    pricing = price_cart()
+    items = pricing['items']
     if not items:
         flash('Your cart is empty', 'error')
         return redirect('/cart')
     
     # Check stock availability
-    for item in items:
-        product = Product.query.get(int(item['id']))
-        if product and product.stock < item['quantity']:
-            flash(f'{product.name} has only {product.stock} items in stock', 'error')
-            return redirect('/cart')
+    if pricing['shortages']:
+        item = pricing['shortages'][0]
+        flash(f"{item['name']} has only {item['stock']} items in stock", 'error')
+        return redirect('/cart')
     
-    total = get_cart_total()
+    total = pricing['total']
     user = User.query.get(session['user_id'])
     
     return render_template('checkout.html',
@@ -505,75 +2112,70 @@ def create_order():
         return jsonify({'success': False, 'message': 'Please login'})
     
     user = User.query.get(session['user_id'])
-    items = get_cart_items()
-    total = get_cart_total()
+    pricing = price_cart()
+    items = pricing['items']
+    total = pricing['total']
     
     if not items:
         return jsonify({'success': False, 'message': 'Cart is empty'})
     
     # Check stock again before creating order
-    for item in items:
-        product = Product.query.get(int(item['id']))
-        if product and product.stock < item['quantity']:
-            return jsonify({'success': False, 'message': f'{product.name} is out of stock'})
+    if pricing['shortages']:
+        item = pricing['shortages'][0]
+        return jsonify({'success': False, 'message': f"{item['name']} is out of stock"})
     
     # Generate order ID
     order_id = generate_order_id()
     
-    # Save order to database
+    # Save order and reserve its stock in one transaction
     try:
         order = Order(
             order_id=order_id,
             user_id=user.id,
             user_email=user.email,
-            items=json.dumps(items),  # Convert list to JSON string
+            line_items=[OrderItem.from_cart_item(item) for item in items],
             total=total,
-            status='Created'
+            status='Created',
+            gateway_status='pending',
+            reserved_until=datetime.utcnow() + timedelta(minutes=app.config['RESERVATION_TTL_MINUTES'])
         )
-        db.session.add(order)
+        order.summarize_lines()
         
-        # Update product stock
-        for item in items:
-            product = Product.query.get(int(item['id']))
-            if product:
-                product.stock -= item['quantity']
+        short_id = reserve_stock([(int(item['id']), item['quantity']) for item in items])
+        if short_id is not None:
+            db.session.rollback()
+            product = pricing['products'][short_id]
+            return jsonify({'success': False, 'message': f'{product.name} is out of stock'})
         
+        db.session.add(order)
+        # The metrics and summary read the order's id and created_at
+        db.session.flush()
+        record_order_metrics(order)
+        enqueue_after_commit('reservation_expired', delay=app.config['RESERVATION_TTL_MINUTES'] * 60,
+                             order_pk=order.id)
         db.session.commit()
+        catalog_cache.invalidate('admin:products',
+                                 *[f"product:{item['id']}" for item in items])
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': f'Failed to create order: {str(e)}'})
     
-    # Create Razorpay order
-    try:
-        razorpay_order = razorpay_client.order.create({
-            'amount': int(total * 100),  # Convert to paise
-            'currency': 'INR',
-            'payment_capture': 1,
-            'receipt': order_id
-        })
-        
-        # Update order with Razorpay order ID
-        order.razorpay_order_id = razorpay_order['id']
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'order_id': razorpay_order['id'],
-            'amount': total * 100,
-            'currency': 'INR',
-            'key': os.getenv('RAZORPAY_KEY_ID'),
-            'name': 'Modern Shop',
-            'description': 'Order Payment',
-            'receipt': order_id,
-            'user': {
-                'name': user.name,
-                'email': user.email,
-                'phone': user.phone or '9999999999'
-            }
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Payment gateway error: {str(e)}'})
+    # Create Razorpay order, off the request thread unless configured otherwise
+    if app.config['RAZORPAY_ASYNC']:
+        try:
+            gateway_pool.submit(open_gateway_order_async, order.id)
+        except GatewayBusy:
+            release_reservation(order)
+            order.gateway_status = 'failed'
+            db.session.commit()
+            return jsonify({'success': False, 'message': 'Payment service is busy. Please try again shortly.'})
+        return gateway_pending_response(order)
+    
+    error = open_gateway_order(order)
+    if error:
+        return jsonify({'success': False, 'message': f'Payment gateway error: {error}'})
+    return jsonify(payment_options(order, user))
 
 @app.route('/payment-success', methods=['POST'])
 def payment_success():
@@ -586,11 +2188,21 @@ def payment_success():
         order = Order.query.filter_by(razorpay_order_id=order_id).first()
         if order:
             order.payment_id = payment_id
-            order.status = 'Paid'
+            # Only pay the order we loaded if its hold has not been released since
+            if not set_order_status(order, 'Paid', only_from='Created'):
+                # A reservation that timed out has already returned its stock
+                if order.status == 'Cancelled' and reserve_stock(order_stock_lines(order)) is not None:
+                    db.session.rollback()
+                    order.payment_id = payment_id
+                    db.session.commit()
+                    flash('Your payment was received but some items sold out. Please contact support for a refund.', 'error')
+                    return redirect('/orders')
+                set_order_status(order, 'Paid')
+            order.reserved_until = None
             db.session.commit()
         
         # Clear cart
-        session.pop('cart', None)
+        save_cart({})
         
         flash('Payment successful! Your order has been placed.', 'success')
         return redirect('/orders')
@@ -601,6 +2213,12 @@ def payment_success():
 
 @app.route('/payment-failed')
 def payment_failed():
+    order_id = request.args.get('order_id')
+    if order_id and is_logged_in():
+        order = Order.query.filter_by(order_id=order_id, user_email=session.get('user_email')).first()
+        if order and release_reservation(order):
+            db.session.commit()
+    
     flash('Payment failed. Please try again.', 'error')
     return redirect('/checkout')
 
@@ -609,15 +2227,16 @@ def orders():
     if not is_logged_in():
         return redirect('/login')
     
-    user = User.query.get(session['user_id'])
-    user_orders = Order.query.filter_by(user_email=user.email).order_by(Order.created_at.desc()).all()
-    
-    # Parse order items for each order
-    for order in user_orders:
-        order.parsed_items = parse_order_items(order.items)
+    summary = db.session.get(OrderSummary, session.get('user_email'))
+    page = paginate_keyset(Order.query.filter_by(user_email=session.get('user_email'))
+                           .options(selectinload(Order.line_items)),
+                           [Order.created_at, Order.id], request.args.get('cursor'))
+    user_orders = page['items']
     
     return render_template('orders.html', 
-                         orders=user_orders)
+                         summary=summary,
+                         orders=user_orders,
+                         page=page)
 
 @app.route('/order/<string:order_id>')
 def order_detail(order_id):
@@ -629,8 +2248,7 @@ def order_detail(order_id):
         flash('Access denied', 'error')
         return redirect('/')
     
-    # Parse order items
-    items = parse_order_items(order.items)
+    items = order.line_items
     
     return render_template('order_detail.html', 
                          order=order,
@@ -643,20 +2261,17 @@ def admin_dashboard():
         flash('Access denied', 'error')
         return redirect('/')
     
-    total_orders = Order.query.count()
-    total_products = Product.query.count()
+    metrics = get_dashboard_metrics()
+    total_products = catalog_cache.get_or_load('count:products', Product.query.count)
     total_users = User.query.count()
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(10).all()
     
-    # Parse order items for recent orders
-    for order in recent_orders:
-        order.parsed_items = parse_order_items(order.items)
-    
     return render_template('admin/dashboard.html',
-                         total_orders=total_orders,
+                         total_orders=metrics['total_orders'],
                          total_products=total_products,
                          total_users=total_users,
-                         recent_orders=recent_orders)
+                         recent_orders=recent_orders,
+                         metrics=metrics)
 
 @app.route('/admin/products')
 def admin_products():
@@ -664,7 +2279,7 @@ def admin_products():
         flash('Access denied', 'error')
         return redirect('/')
     
-    products = Product.query.all()
+    products = cached_products('admin:products', Product.query.all)
     return render_template('admin/products.html', 
                          products=products)
 
@@ -706,6 +2321,7 @@ def add_product():
             
             db.session.add(product)
             db.session.commit()
+            invalidate_catalog()
             
             flash('Product added successfully!', 'success')
             return redirect('/admin/products')
@@ -713,8 +2329,7 @@ def add_product():
             flash(f'Error adding product: {str(e)}', 'error')
             return redirect('/admin/add-product')
     
-    categories = ['Electronics', 'Fashion', 'Home', 'Books', 'Sports', 'Beauty']
-    return render_template('admin/add_product.html', categories=categories)
+    return render_template('admin/add_product.html', categories=CATEGORIES)
 
 @app.route('/admin/edit-product/<int:id>', methods=['GET', 'POST'])
 def edit_product(id):
@@ -738,13 +2353,37 @@ def edit_product(id):
             product.stock = int(request.form.get('stock', '10'))
             
             db.session.commit()
+            invalidate_catalog()
             flash('Product updated successfully!', 'success')
             return redirect('/admin/products')
         except Exception as e:
             flash(f'Error updating product: {str(e)}', 'error')
     
-    categories = ['Electronics', 'Fashion', 'Home', 'Books', 'Sports', 'Beauty']
-    return render_template('admin/edit_product.html', product=product, categories=categories)
+    return render_template('admin/edit_product.html', product=product, categories=CATEGORIES)
+
+@app.route('/admin/import-products', methods=['GET', 'POST'])
+def admin_import_products():
+    if not is_logged_in() or not is_admin():
+        flash('Access denied', 'error')
+        return redirect('/')
+    
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        fmt = request.form.get('format') or product_import.detect_format(upload.filename if upload else None)
+        if not upload or not upload.filename:
+            flash('Choose a file to import', 'error')
+        elif fmt not in product_import.FORMATS:
+            flash('Upload a .csv or .jsonl file', 'error')
+        else:
+            # Werkzeug spools large uploads to disk, so this reads row by row
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            report = import_products(stream, fmt, dry_run=bool(request.form.get('dry_run')))
+            flash(f"{'Checked' if request.form.get('dry_run') else 'Imported'}: {report.summary()}",
+                  'success' if not report.failed else 'warning')
+    
+    return render_template('admin/import_products.html', report=report, categories=CATEGORIES,
+                           formats=product_import.FORMATS)
 
 @app.route('/admin/delete-product/<int:id>')
 def delete_product(id):
@@ -756,6 +2395,7 @@ def delete_product(id):
         product = Product.query.get_or_404(id)
         db.session.delete(product)
         db.session.commit()
+        invalidate_catalog()
         flash('Product deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting product: {str(e)}', 'error')
@@ -768,14 +2408,69 @@ def admin_orders():
         flash('Access denied', 'error')
         return redirect('/')
     
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    
-    # Parse order items for each order
-    for order in orders:
-        order.parsed_items = parse_order_items(order.items)
+    page = paginate_keyset(Order.query, [Order.created_at, Order.id], request.args.get('cursor'))
+    orders = page['items']
     
     return render_template('admin/orders.html', 
-                         orders=orders)
+                         orders=orders,
+                         page=page)
+
+def export_query(dataset, since=None, until=None, status=None):
+    """SELECT for one admin export, in a stable order an index can serve"""
+    if dataset == 'products':
+        return select(Product.id, Product.sku, Product.name, Product.category, Product.price,
+                      Product.discount_price, Product.stock, Product.rating,
+                      Product.created_at).order_by(Product.id)
+    
+    if dataset == 'orders':
+        query = select(Order.order_id, Order.created_at, Order.user_email, Order.status,
+                       Order.total, Order.payment_id, Order.razorpay_order_id)
+    else:
+        query = (select(Order.order_id, Order.created_at.label('order_created_at'),
+                        Order.status.label('order_status'), OrderItem.product_id, OrderItem.name,
+                        OrderItem.price, OrderItem.quantity, OrderItem.total)
+                 .join(OrderItem, OrderItem.order_id == Order.id))
+    if since:
+        query = query.where(Order.created_at >= since)
+    if until:
+        query = query.where(Order.created_at < until)
+    if status:
+        query = query.where(Order.status == status)
+    order_by = [Order.created_at, Order.id]
+    if dataset == 'order-items':
+        order_by.append(OrderItem.id)
+    return query.order_by(*order_by)
+
+EXPORT_DATASETS = ('orders', 'order-items', 'products')
+
+@app.route('/admin/export/<dataset>.<fmt>')
+def admin_export(dataset, fmt):
+    """Stream a dataset as CSV or JSON; orders and order-items accept
+    ?since=YYYY-MM-DD, ?until=YYYY-MM-DD (exclusive) and ?status="""
+    if not is_logged_in() or not is_admin():
+        flash('Access denied', 'error')
+        return redirect('/')
+    
+    if dataset not in EXPORT_DATASETS or fmt not in exports.FORMATS:
+        flash('Unknown export', 'error')
+        return redirect('/admin')
+    
+    try:
+        since, until = [datetime.strptime(request.args[key], '%Y-%m-%d') if request.args.get(key) else None
+                        for key in ('since', 'until')]
+    except ValueError:
+        flash('Dates must look like 2024-01-31', 'error')
+        return redirect('/admin')
+    
+    query = export_query(dataset, since, until, request.args.get('status'))
+    result = db.session.execute(query.execution_options(yield_per=app.config['EXPORT_BATCH_SIZE']))
+    encode, mimetype = exports.FORMATS[fmt]
+    
+    response = Response(stream_with_context(encode(list(result.keys()), result)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={dataset}-{date.today():%Y%m%d}.{fmt}'
+    # Ask a fronting nginx not to buffer the whole export before sending it
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/admin/update-order-status/<string:order_id>', methods=['POST'])
 def update_order_status(order_id):
@@ -785,13 +2480,34 @@ def update_order_status(order_id):
     order = Order.query.filter_by(order_id=order_id).first_or_404()
     new_status = request.json.get('status')
     
-    if new_status in ['Pending', 'Paid', 'Shipped', 'Delivered', 'Cancelled']:
-        order.status = new_status
+    if new_status in ORDER_STATUSES:
+        # Cancelling an unpaid order also hands back its stock hold
+        if not (new_status == 'Cancelled' and release_reservation(order)):
+            set_order_status(order, new_status)
         db.session.commit()
         return jsonify({'success': True, 'message': 'Order status updated'})
     
     return jsonify({'success': False, 'message': 'Invalid status'})
 
+@app.route('/admin/cache-stats')
+def admin_cache_stats():
+    if not is_logged_in() or not is_admin():
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    return jsonify({'success': True, 'catalog': catalog_cache.stats(), 'fragments': fragment_cache.stats()})
+
+@app.route('/metrics')
+def metrics():
+    if not app.config['INSTRUMENTATION']:
+        return Response('Instrumentation is disabled\n', status=404, mimetype='text/plain')
+    token = app.config['METRICS_TOKEN']
+    bearer = request.headers.get('Authorization', '')
+    scraper = token and secrets.compare_digest(bearer, f'Bearer {token}')
+    if not scraper and not (is_logged_in() and is_admin()):
+        abort(403)
+    
+    return Response(instrumentation.metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # AJAX endpoints
 @app.route('/api/cart-count')
 def api_cart_count():
@@ -799,10 +2515,104 @@ def api_cart_count():
 
 @app.route('/api/clear-cart')
 def clear_cart():
-    if 'cart' in session:
-        session.pop('cart')
+    save_cart({})
     return jsonify({'success': True})
 
+@app.route('/api/order-status/<string:order_id>')
+def api_order_status(order_id):
+    if not is_logged_in():
+        return jsonify({'success': False, 'message': 'Please login'})
+    
+    order = Order.query.filter_by(order_id=order_id, user_email=session.get('user_email')).first_or_404()
+    if order.gateway_status == 'ready':
+        return jsonify(payment_options(order, User.query.get(session['user_id'])))
+    if order.gateway_status == 'failed':
+        return jsonify({'success': False, 'message': 'Payment gateway error. Please try again.'})
+    return gateway_pending_response(order)
+
+# JSON API, version 1: compact responses for the storefront scripts
+API_PRODUCT_FIELDS = ('id', 'name', 'category', 'image', 'price', 'discount_price', 'effective_price',
+                      'discount_percent', 'rating', 'stock')
+API_MAX_CART_CHANGES = 50
+
+def api_error(message, status=400):
+    return jsonify({'success': False, 'message': message}), status
+
+def api_product(product):
+    return {field: getattr(product, field) for field in API_PRODUCT_FIELDS}
+
+def api_cart_line(item, detail=False):
+    line = {'id': item['id'], 'quantity': item['quantity'], 'price': item['price'], 'total': item['total']}
+    if detail:
+        line.update(name=item['name'], image=item['image'])
+    return line
+
+@app.route('/api/v1/products')
+@replica_reads
+def api_products():
+    page = load_product_page(request.args.get('category', ''), request.args.get('search', '').strip(),
+                             request.args.get('cursor'), get_page_size(), get_product_sort(), get_listing_filters())
+    return jsonify({'items': [api_product(p) for p in page['items']], 'next_cursor': page['next_cursor']})
+
+@app.route('/api/v1/products/<int:product_id>')
+@replica_reads
+def api_product_detail(product_id):
+    product = get_catalog_product(product_id)
+    if product is None:
+        return api_error('Product not found', 404)
+    return jsonify(api_product(product))
+
+@app.route('/api/v1/cart')
+def api_cart():
+    pricing = price_cart()
+    return jsonify({
+        'lines': [api_cart_line(item, detail=True) for item in pricing['items']],
+        'total': pricing['total'],
+        'count': pricing['count']
+    })
+
+@app.route('/api/v1/cart', methods=['POST'])
+def api_update_cart():
+    """Apply one change or a ``{"changes": [...]}`` batch; answers with only the
+    changed lines (quantity 0 when removed), the new total and the item count"""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return api_error('Expected a JSON object')
+    changes = body['changes'] if 'changes' in body else [body]
+    if not isinstance(changes, list) or not changes:
+        return api_error('changes must be a non-empty list')
+    if len(changes) > API_MAX_CART_CHANGES:
+        return api_error(f'At most {API_MAX_CART_CHANGES} changes per request')
+    
+    pricing, changed = apply_cart_changes(changes)
+    if pricing is None:
+        return api_error(changed)
+    
+    lines = {item['id']: item for item in pricing['items']}
+    return jsonify({
+        'success': True,
+        'lines': [api_cart_line(lines[product_id]) if product_id in lines
+                  else {'id': product_id, 'quantity': 0, 'total': 0}
+                  for product_id in changed],
+        'total': pricing['total'],
+        'count': pricing['count']
+    })
+
+@app.route('/api/v1/orders')
+def api_orders():
+    if not is_logged_in():
+        return api_error('Please login', 401)
+    
+    page = paginate_keyset(Order.query.filter_by(user_email=session.get('user_email')),
+                           [Order.created_at, Order.id], request.args.get('cursor'))
+    return jsonify({
+        'items': [{'order_id': order.order_id, 'status': order.status, 'total': order.total,
+                   'items': order.item_count or 0, 'preview': order.preview,
+                   'created_at': order.created_at.isoformat()}
+                  for order in page['items']],
+        'next_cursor': page['next_cursor']
+    })
+
 # Health check endpoint
 @app.route('/health')
 def health():
@@ -825,6 +2635,9 @@ if __name__ == '__main__':
     print("🌐 Server running at: http://localhost:5000")
     print("🔑 Admin login: admin@shop.com / admin123")
     print("=" * 60)
+    with app.app_context():
+        migrate_database()
+        seed_database()
     app.run(debug=True, port=5000)
 
 if __name__ == "__main__":
@@ -0,0 +1,366 @@
+"""Benchmark the storefront, cart and checkout flows on a large synthetic dataset.
+
+    python benchmark.py                        # seed on first run, then measure
+    python benchmark.py --save-baseline        # measure and record as the baseline
+    python benchmark.py --products 2000 --orders 20000 --requests 50   # quick run
+
+The first run seeds ``--database`` (100k products, 1M orders and their line
+items by default) with a fixed random seed; later runs reuse it, so results
+are comparable between runs. Requests go through the Flask test client and
+Razorpay calls go to the local stub gateway, so nothing leaves the machine.
+
+Each route reports throughput and p50/p95/p99 latency. With a baseline file
+present, p95 is compared against it and the run exits non-zero if any route
+got slower than ``--tolerance``.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from stub_gateway import serve_in_thread
+
+CATEGORIES = ['Electronics', 'Fashion', 'Home', 'Books', 'Sports', 'Beauty']
+ADJECTIVES = ['Classic', 'Smart', 'Wireless', 'Premium', 'Compact', 'Organic', 'Vintage', 'Ultra',
+              'Portable', 'Deluxe', 'Eco', 'Pro']
+NOUNS = ['Headphones', 'Sneakers', 'Lamp', 'Novel', 'Backpack', 'Serum', 'Watch', 'Jacket',
+         'Speaker', 'Mug', 'Yoga Mat', 'Keyboard', 'Perfume', 'Camera', 'Blender', 'Football']
+STATUSES = ['Paid', 'Shipped', 'Delivered', 'Cancelled', 'Created']
+STATUS_WEIGHTS = [30, 20, 40, 7, 3]
+BATCH_SIZE = 20000
+CART_PRODUCTS = 3
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the shop on a large synthetic dataset')
+    parser.add_argument('--database', default='instance/bench.db', help='SQLite file to seed and use')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--reseed', action='store_true', help='delete the database and seed it again')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per route')
+    parser.add_argument('--concurrency', type=int, default=1, help='client threads per route')
+    parser.add_argument('--routes', help='comma-separated subset of routes to run')
+    parser.add_argument('--gateway-delay', type=float, default=0.0, help='stub gateway latency in seconds')
+    parser.add_argument('--async-gateway', action='store_true',
+                        help='create gateway orders on the background pool (RAZORPAY_ASYNC=1)')
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.20,
+                        help='allowed p95 slowdown against the baseline, as a fraction')
+    parser.add_argument('--seed', type=int, default=1234)
+    return parser.parse_args()
+
+
+# Seeding
+def insert_batches(shop, table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        shop.db.session.execute(table.insert(), rows[start:start + BATCH_SIZE])
+    shop.db.session.commit()
+
+
+def seed(shop, args, rng):
+    """Fill an empty database with users, products and order history"""
+    from werkzeug.security import generate_password_hash
+
+    password = generate_password_hash('bench-password')
+    now = datetime.utcnow()
+
+    print(f"Seeding {args.users} users, {args.products} products, {args.orders} orders...")
+    started = time.perf_counter()
+    insert_batches(shop, shop.User.__table__, [
+        {'id': i, 'name': f'Bench User {i}', 'email': f'bench{i}@example.com', 'password': password,
+         'phone': '9999999999', 'address': 'Bench Street', 'is_admin': False, 'created_at': now}
+        for i in range(1, args.users + 1)
+    ])
+
+    products = []
+    for i in range(1, args.products + 1):
+        price = round(rng.uniform(100, 100000), 2)
+        discount_price = round(price * rng.uniform(0.6, 0.95), 2) if rng.random() < 0.3 else None
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}'
+        products.append({
+            'id': i, 'name': name, 'description': f'{name} for everyday use', 'price': price,
+            'discount_price': discount_price,
+            'category': rng.choice(CATEGORIES), 'image': 'https://via.placeholder.com/300',
+            'stock': 1000000, 'rating': round(rng.uniform(3.0, 5.0), 1), 'created_at': now,
+            # Core inserts skip the Product validator that derives these
+            **shop.product_pricing(price, discount_price)
+        })
+    insert_batches(shop, shop.Product.__table__, products)
+
+    prices = [p['effective_price'] for p in products]
+    names = [p['name'] for p in products]
+    del products
+
+    item_id = 1
+    for start in range(0, args.orders, BATCH_SIZE):
+        orders, items = [], []
+        for order_pk in range(start + 1, min(start + BATCH_SIZE, args.orders) + 1):
+            user_id = rng.randint(1, args.users)
+            total = 0
+            for _ in range(rng.randint(1, 3)):
+                product_id = rng.randint(1, args.products)
+                quantity = rng.randint(1, 3)
+                price = prices[product_id - 1]
+                items.append({'id': item_id, 'order_id': order_pk, 'product_id': product_id,
+                              'name': names[product_id - 1], 'price': price,
+                              'image': 'https://via.placeholder.com/300',
+                              'quantity': quantity, 'total': price * quantity})
+                item_id += 1
+                total += price * quantity
+            orders.append({
+                'id': order_pk, 'order_id': f'BENCH{order_pk:010d}', 'user_id': user_id,
+                'user_email': f'bench{user_id}@example.com', 'total': round(total, 2),
+                'payment_id': f'pay_bench{order_pk}',
+                'status': rng.choices(STATUSES, STATUS_WEIGHTS)[0],
+                'created_at': now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            })
+        insert_batches(shop, shop.Order.__table__, orders)
+        insert_batches(shop, shop.OrderItem.__table__, items)
+        print(f"  {start + len(orders)} orders")
+
+    shop.rebuild_dashboard_metrics()
+    shop.rebuild_co_purchases()
+    shop.backfill_order_previews()
+    shop.rebuild_order_summaries()
+    shop.db.session.execute(shop.db.text('ANALYZE'))
+    shop.db.session.commit()
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+
+def prepare_database(shop, args, rng):
+    with shop.app.app_context():
+        shop.migrate_database()
+        products = shop.Product.query.count()
+        orders = shop.Order.query.count()
+        if products == 0 and orders == 0:
+            seed(shop, args, rng)
+        elif products < args.products or orders < args.orders:
+            sys.exit(f"{args.database} holds {products} products and {orders} orders; "
+                     f"run with --reseed to rebuild it at the requested size")
+        else:
+            print(f"Reusing {args.database} ({products} products, {orders} orders)")
+        return {
+            'users': shop.User.query.count(),
+            'products': shop.Product.query.count(),
+            'words': [noun.split()[0].lower() for noun in NOUNS],
+        }
+
+
+# Scenarios
+class Client:
+    """Test client logged in as one bench user, with a few products in the cart"""
+
+    def __init__(self, shop, user_id, rng, dataset):
+        self.shop = shop
+        self.rng = rng
+        self.dataset = dataset
+        self.http = shop.app.test_client()
+        self.etag = None
+        with self.http.session_transaction() as sess:
+            sess.update(user_id=user_id, user_name=f'Bench User {user_id}',
+                        user_email=f'bench{user_id}@example.com', is_admin=False)
+        self.cart_products = [self.random_product() for _ in range(CART_PRODUCTS)]
+        for product_id in self.cart_products:
+            self.http.post('/update-cart', data={'product_id': product_id, 'action': 'increase'})
+
+    def random_product(self):
+        return self.rng.randint(1, self.dataset['products'])
+
+    def home(self):
+        return self.http.get('/')
+
+    def home_revalidate(self):
+        # A repeat visit: the browser presents the ETag it already holds
+        response = self.http.get('/', headers={'If-None-Match': self.etag} if self.etag else {})
+        self.etag = response.headers.get('ETag')
+        return response
+
+    def products_category(self):
+        return self.http.get(f'/products?category={self.rng.choice(CATEGORIES)}')
+
+    def products_search(self):
+        return self.http.get(f"/products?search={self.rng.choice(self.dataset['words'])}")
+
+    def product_detail(self):
+        return self.http.get(f'/product/{self.random_product()}')
+
+    def orders(self):
+        return self.http.get('/orders')
+
+    def update_cart(self):
+        # Bump and drop one cart line so the cart stays the same size
+        product_id = self.rng.choice(self.cart_products)
+        self.http.post('/update-cart', data={'product_id': product_id, 'action': 'increase'})
+        return self.http.post('/update-cart', data={'product_id': product_id, 'action': 'decrease'})
+
+    def checkout(self):
+        return self.http.get('/checkout')
+
+    def create_order(self):
+        return self.http.post('/create-order')
+
+
+ROUTES = ['home', 'home_revalidate', 'products_category', 'products_search', 'product_detail', 'orders',
+          'update_cart', 'checkout', 'create_order']
+
+
+def succeeded(response):
+    if response.status_code not in (200, 304):
+        return False
+    if response.is_json:
+        return response.get_json().get('success', True)
+    return True
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def run_route(clients, route, requests, warmup):
+    """Drive one route from every client thread; returns its result dict.
+
+    Throughput is measured requests over the time from the first measured
+    request starting to the last one finishing, so warmup is excluded.
+    """
+    latencies, windows = [], []
+    errors = [0]
+    lock = threading.Lock()
+    per_client = max(1, requests // len(clients))
+    ready = threading.Barrier(len(clients))
+
+    def worker(client):
+        call = getattr(client, route)
+        for _ in range(warmup):
+            call()
+        ready.wait()
+        timings, failed = [], 0
+        window_start = time.perf_counter()
+        for _ in range(per_client):
+            started = time.perf_counter()
+            try:
+                ok = succeeded(call())
+            except Exception:
+                ok = False
+            timings.append(time.perf_counter() - started)
+            if not ok:
+                failed += 1
+        with lock:
+            latencies.extend(timings)
+            windows.append((window_start, time.perf_counter()))
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = max(end for _, end in windows) - min(start for start, _ in windows)
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the results table; returns the routes whose p95 regressed"""
+    regressions = []
+    print(f"\n{'route':<20}{'reqs':>7}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'p95 vs base':>14}")
+    for route, result in results.items():
+        change = ''
+        base = baseline.get(route)
+        if base and base.get('p95_ms'):
+            delta = (result['p95_ms'] - base['p95_ms']) / base['p95_ms']
+            change = f'{delta:+.0%}'
+            if delta > tolerance:
+                regressions.append(route)
+                change += ' !!'
+        print(f"{route:<20}{result['requests']:>7}{result['errors']:>8}{result['rps']:>10}"
+              f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}{change:>14}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    database = os.path.abspath(args.database)
+    # Tasks queued by checkouts refer to bench order ids, so they live with the bench database
+    task_queue = os.path.splitext(database)[0] + '-tasks.db'
+    if args.reseed:
+        for path in (database, task_queue):
+            if os.path.exists(path):
+                os.remove(path)
+    os.makedirs(os.path.dirname(database), exist_ok=True)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    gateway_url, _, server = serve_in_thread(delay=args.gateway_delay)
+    # The app reads its configuration at import time
+    os.environ.update(
+        DATABASE_URL=f'sqlite:///{database}',
+        CART_STORE='memory://',
+        TASK_QUEUE_PATH=task_queue,
+        RAZORPAY_BASE_URL=gateway_url,
+        RAZORPAY_ASYNC='1' if args.async_gateway else '0',
+        INSTRUMENTATION='0'
+    )
+    import app as shop
+
+    dataset = prepare_database(shop, args, rng)
+    routes = args.routes.split(',') if args.routes else ROUTES
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        sys.exit(f"Unknown routes: {', '.join(sorted(unknown))}")
+
+    # No app context here: requests made on a thread with one pushed would share
+    # its g (the memoized cart) between simulated users
+    results = {}
+    for route in routes:
+        clients = [Client(shop, rng.randint(1, dataset['users']), random.Random(rng.random()), dataset)
+                   for _ in range(args.concurrency)]
+        results[route] = run_route(clients, route, args.requests, args.warmup)
+    server.shutdown()
+    shop.gateway_pool.shutdown(wait=False)
+
+    settings = {'products': args.products, 'orders': args.orders, 'concurrency': args.concurrency,
+                'async_gateway': args.async_gateway, 'gateway_delay': args.gateway_delay}
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        baseline = saved.get('routes', {})
+        if saved.get('settings') != settings:
+            print(f"Warning: baseline was recorded with {saved.get('settings')}, this run used {settings}")
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'recorded_at': datetime.utcnow().isoformat(timespec='seconds'),
+                       'settings': settings,
+                       'routes': results}, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif regressions:
+        print(f"\np95 regressed by more than {args.tolerance:.0%} on: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
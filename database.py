@@ -0,0 +1,74 @@
+"""Engine settings for the primary database and an optional read replica.
+
+SQLite connections are switched to WAL with ``synchronous=NORMAL`` and a busy
+timeout, so readers never block the writer and concurrent writers wait for the
+lock instead of failing with "database is locked". Server databases such as
+PostgreSQL get a sized, pre-pinged and recycled connection pool.
+
+``RoutingSession`` sends the SELECTs of a session marked with
+``session.info['use_replica']`` to the ``replica`` bind; flushes and DML always
+go to the primary. ``replica_url('local', primary)`` returns the primary URL so
+the same file can stand in for a replica, opened read-only with
+``PRAGMA query_only`` so a write routed to it fails loudly.
+"""
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+REPLICA = 'replica'
+
+
+def is_sqlite(url):
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+def engine_options(url, pool_size=10, max_overflow=20, pool_timeout=30, pool_recycle=1800):
+    """Keyword arguments for ``create_engine`` suited to the database at ``url``"""
+    if is_sqlite(url):
+        # Flask-SQLAlchemy already picks the right pool for files and :memory:
+        return {}
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        # Drop connections the server or a proxy may have closed while idle
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': True,
+    }
+
+
+def replica_url(replica, primary):
+    """The URL for the replica bind; 'local' reuses the primary database"""
+    if not replica:
+        return None
+    return primary if replica == 'local' else replica
+
+
+def configure_sqlite(engine, busy_timeout=5000, synchronous='NORMAL', read_only=False):
+    """Set the per-connection pragmas on every connection ``engine`` opens"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout)}')
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')
+        else:
+            # Persistent in the file; a no-op once set, ignored for :memory:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute(f'PRAGMA synchronous={synchronous}')
+        cursor.close()
+
+
+class RoutingSession(Session):
+    """Session that reads from the replica bind when ``info['use_replica']`` is set"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get('use_replica') and not self._flushing
+                and not getattr(clause, 'is_dml', False)):
+            replica = self._db.engines.get(REPLICA)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,52 @@
+"""Streaming CSV and JSON encoders for admin exports.
+
+Both take the column names and an iterable of row tuples and yield the encoded
+document in chunks, so a response built from them starts sending at once and
+never holds more than one chunk in memory. Feed them from a query run with
+``yield_per`` to keep the database side constant-memory too.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+
+CHUNK_ROWS = 500
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def stream_csv(columns, rows, chunk_rows=CHUNK_ROWS):
+    """Yield a CSV document with a header row, ``chunk_rows`` rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_plain(value) for value in row])
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_json(columns, rows, chunk_rows=CHUNK_ROWS):
+    """Yield a JSON array of objects keyed by ``columns``, ``chunk_rows`` rows at a time"""
+    chunk = ['[']
+    for count, row in enumerate(rows, 1):
+        record = json.dumps({column: _plain(value) for column, value in zip(columns, row)})
+        chunk.append(record if count == 1 else ',\n' + record)
+        if count % chunk_rows == 0:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']\n')
+    yield ''.join(chunk)
+
+
+FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'json': (stream_json, 'application/json'),
+}
@@ -0,0 +1,207 @@
+"""Opt-in request profiling and SQL instrumentation.
+
+For every request this records wall time, the number of SQL queries and the
+time spent in them, and the time spent rendering templates, aggregated into
+per-endpoint histograms that ``Metrics.render()`` writes in the Prometheus text
+format. A request that runs the same statement ``n_plus_one_threshold`` times
+or more is counted and logged as a likely N+1 query.
+
+    instrumentation = Instrumentation(app)
+    ...
+    instrumentation.metrics.render()
+"""
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """Thread-safe store of per-endpoint histograms and counters"""
+
+    HISTOGRAMS = (
+        ('request_duration_seconds', 'Wall time per request', DURATION_BUCKETS),
+        ('sql_queries_per_request', 'SQL statements executed per request', QUERY_COUNT_BUCKETS),
+        ('sql_duration_seconds', 'Time spent in SQL per request', DURATION_BUCKETS),
+        ('template_render_seconds', 'Time spent rendering templates per request', DURATION_BUCKETS),
+    )
+
+    def __init__(self, prefix='shop'):
+        self.prefix = prefix
+        self._histograms = {name: {} for name, _, _ in self.HISTOGRAMS}
+        self._requests = Counter()
+        self._n_plus_one = Counter()
+        self._lock = threading.Lock()
+
+    def observe_request(self, endpoint, status, duration, queries, sql_time, template_time, n_plus_one):
+        values = {
+            'request_duration_seconds': duration,
+            'sql_queries_per_request': queries,
+            'sql_duration_seconds': sql_time,
+            'template_render_seconds': template_time,
+        }
+        with self._lock:
+            for name, _, buckets in self.HISTOGRAMS:
+                histogram = self._histograms[name].get(endpoint)
+                if histogram is None:
+                    histogram = self._histograms[name][endpoint] = Histogram(buckets)
+                histogram.observe(values[name])
+            self._requests[(endpoint, status)] += 1
+            if n_plus_one:
+                self._n_plus_one[endpoint] += 1
+
+    def reset(self):
+        with self._lock:
+            for histograms in self._histograms.values():
+                histograms.clear()
+            self._requests.clear()
+            self._n_plus_one.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            name = f'{self.prefix}_requests_total'
+            lines += [f'# HELP {name} Requests handled', f'# TYPE {name} counter']
+            for (endpoint, status), count in sorted(self._requests.items()):
+                lines.append(f'{name}{{endpoint="{_escape(endpoint)}",status="{status}"}} {count}')
+
+            name = f'{self.prefix}_n_plus_one_requests_total'
+            lines += [f'# HELP {name} Requests that repeated one SQL statement past the N+1 threshold',
+                      f'# TYPE {name} counter']
+            for endpoint, count in sorted(self._n_plus_one.items()):
+                lines.append(f'{name}{{endpoint="{_escape(endpoint)}"}} {count}')
+
+            for metric, description, _ in self.HISTOGRAMS:
+                name = f'{self.prefix}_{metric}'
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+                for endpoint, histogram in sorted(self._histograms[metric].items()):
+                    label = f'endpoint="{_escape(endpoint)}"'
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{{label}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestStats:
+    """What one request has done so far; lives on ``flask.g``"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = Counter()
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.template_started = 0.0
+        self.status = 500
+
+
+class Instrumentation:
+    """Flask extension wiring request hooks, template signals and SQLAlchemy
+    engine events into a ``Metrics`` store"""
+
+    def __init__(self, app=None, n_plus_one_threshold=5, metrics=None):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.metrics = metrics or Metrics()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app, weak=False)
+        template_rendered.connect(self._after_render, app, weak=False)
+        # Listening on the Engine class covers every engine the app creates
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def _before_request(self):
+        g.request_stats = RequestStats()
+
+    def _after_request(self, response):
+        stats = g.get('request_stats')
+        if stats is not None:
+            stats.status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return
+        endpoint = request.endpoint or 'unmatched'
+        repeated = [(statement, count) for statement, count in stats.statements.items()
+                    if count >= self.n_plus_one_threshold]
+        for statement, count in repeated:
+            self.app.logger.warning('Possible N+1 in %s: %d x %s', endpoint, count,
+                                    ' '.join(statement.split())[:200])
+        self.metrics.observe_request(
+            endpoint, stats.status,
+            duration=time.perf_counter() - stats.started,
+            queries=sum(stats.statements.values()),
+            sql_time=stats.sql_time,
+            template_time=stats.template_time,
+            n_plus_one=bool(repeated)
+        )
+
+    def _before_render(self, sender, template, context, **extra):
+        stats = g.get('request_stats') if has_request_context() else None
+        if stats is not None:
+            if stats.template_depth == 0:
+                stats.template_started = time.perf_counter()
+            stats.template_depth += 1
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = g.get('request_stats') if has_request_context() else None
+        if stats is not None and stats.template_depth:
+            stats.template_depth -= 1
+            if stats.template_depth == 0:
+                stats.template_time += time.perf_counter() - stats.template_started
+
+
+def _current_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats()
+    if stats is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats()
+    if stats is not None and conn.info.get('query_started'):
+        stats.sql_time += time.perf_counter() - conn.info['query_started'].pop()
+        stats.statements[statement] += 1
@@ -0,0 +1,59 @@
+"""Idempotent, additive schema migrations.
+
+``sync_schema`` brings an existing database up to the current models without
+touching data: it creates missing tables, adds missing columns and creates
+missing indexes. Running it against an up-to-date database does nothing, so it
+is safe to run on every deploy. Destructive changes (dropping or retyping
+columns) are deliberately out of scope.
+"""
+from sqlalchemy import inspect, text
+
+
+def add_missing_columns(conn, metadata):
+    """ALTER existing tables to add columns the models define; returns what was added"""
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            ddl = (f'ALTER TABLE {preparer.format_table(table)} '
+                   f'ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=conn.dialect)}')
+            if column.server_default is not None:
+                ddl += f' DEFAULT {column.server_default.arg}'
+            conn.execute(text(ddl))
+            if column.unique:
+                # SQLite cannot add a UNIQUE column, so enforce it with an index
+                conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS uq_{table.name}_{column.name} '
+                                  f'ON {preparer.format_table(table)} ({preparer.format_column(column)})'))
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def create_missing_indexes(conn, metadata):
+    """Create every index the models declare that the database lacks"""
+    inspector = inspect(conn)
+    created = []
+    for table in metadata.sorted_tables:
+        present = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(bind=conn, checkfirst=True)
+                created.append(index.name)
+    return created
+
+
+def sync_schema(engine, metadata):
+    """Create missing tables, columns and indexes; returns a list of changes made"""
+    with engine.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        metadata.create_all(bind=conn, checkfirst=True)
+        changes = [f'table {name}' for name in metadata.tables if name not in existing]
+        changes += [f'column {name}' for name in add_missing_columns(conn, metadata)]
+        changes += [f'index {name}' for name in create_missing_indexes(conn, metadata)]
+    return changes
@@ -0,0 +1,200 @@
+"""Password hashing off the request threads, plus login rate limiting.
+
+Hashing is slow on purpose, so a burst of logins could keep every web worker
+busy computing hashes. ``HashPool`` runs hashing in a small process pool. Its
+queue is bounded: once ``max_pending`` jobs are queued or running, ``verify``
+and ``hash`` raise ``HashPoolBusy`` straight away instead of waiting.
+
+``verify`` also returns a new hash when the stored one was made with
+different parameters than the configured ``method``. The caller saves it, so
+stored hashes move to new settings as users log in.
+
+``SlidingWindowLimiter`` counts attempts per key (an IP or an email address)
+over a sliding window, in memory, evicting the least recently used keys.
+"""
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashPoolBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+
+def hash_method(stored_hash):
+    """The method and parameters part of a werkzeug hash, e.g. 'scrypt:32768:8:1'"""
+    return (stored_hash or '').split('$', 1)[0]
+
+
+def _verify(stored_hash, password, method):
+    if not stored_hash or not check_password_hash(stored_hash, password):
+        return False, None
+    if hash_method(stored_hash) != method:
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _process_context():
+    """Start workers from a forkserver that preloads this module.
+
+    Forking the threaded web process itself could copy a lock held by another
+    thread. As with any multiprocessing start method other than fork, the
+    workers import the main module, so scripts must keep their entry point
+    under ``if __name__ == '__main__'`` (app.py, flask and gunicorn do).
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+class HashPool:
+    """Bounded process pool for hashing and checking passwords.
+
+    ``method`` is a werkzeug method such as 'scrypt' or 'pbkdf2:sha256:600000';
+    it is expanded to its full parameters on first use so stored hashes can be
+    compared against it. With ``workers=0`` the work runs on the calling thread,
+    still subject to ``max_pending``.
+    """
+
+    def __init__(self, method='scrypt', workers=2, max_pending=8, timeout=10.0):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._full_method = None
+        self._lock = threading.Lock()
+
+    @property
+    def full_method(self):
+        if self._full_method is None:
+            self._full_method = hash_method(generate_password_hash('', self.method))
+        return self._full_method
+
+    def _call(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashPoolBusy('Too many password checks in progress')
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        executor = None
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=_process_context())
+                executor = self._executor
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard(executor)
+            raise HashPoolBusy('Password workers restarted')
+        except BaseException:
+            self._slots.release()
+            raise
+        # A job we stop waiting for keeps its worker busy, so it keeps its slot
+        # until it finishes; max_pending bounds the hashing, not just the callers
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HashPoolBusy('Password check timed out')
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise HashPoolBusy('Password workers restarted')
+
+    def _discard(self, executor):
+        """A worker died; start a fresh pool on the next call"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+    def verify(self, stored_hash, password):
+        """Return ``(valid, new_hash)``; ``new_hash`` is set when the stored one is outdated"""
+        return self._call(_verify, stored_hash, password, self.full_method)
+
+    def hash(self, password):
+        return self._call(_hash, password, self.full_method)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+class SlidingWindowLimiter:
+    """Allow at most ``limit`` hits per key in any ``window`` seconds.
+
+    Uses the sliding window counter approximation: the previous fixed window's
+    count is weighted by how much of it still overlaps the sliding window.
+    Memory is two counters per key, and at most ``maxsize`` keys are kept.
+    """
+
+    def __init__(self, limit, window, maxsize=100000, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _estimate(self, key, now):
+        """``(window_index, current_count, previous_count)`` for ``key`` at ``now``"""
+        index = int(now // self.window)
+        entry = self._data.get(key)
+        if entry is None:
+            return index, 0, 0
+        entry_index, current, previous = entry
+        if entry_index == index:
+            return index, current, previous
+        if entry_index == index - 1:
+            return index, 0, current
+        return index, 0, 0
+
+    def _weighted(self, now, index, current, previous):
+        return previous * (1 - (now - index * self.window) / self.window) + current
+
+    def hit(self, key):
+        """Record an attempt; returns False (and does not count it) if over the limit"""
+        now = self._clock()
+        with self._lock:
+            index, current, previous = self._estimate(key, now)
+            if self._weighted(now, index, current, previous) + 1 > self.limit:
+                return False
+            self._data[key] = (index, current + 1, previous)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def retry_after(self, key):
+        """Seconds until ``key`` may try again (0 if it may now)"""
+        now = self._clock()
+        with self._lock:
+            index, current, previous = self._estimate(key, now)
+        if self._weighted(now, index, current, previous) + 1 <= self.limit:
+            return 0
+        elapsed = now - index * self.window
+        if previous and current + 1 <= self.limit:
+            # Wait until enough of the previous window has slid out
+            return max(0, (1 - (self.limit - current - 1) / previous) * self.window - elapsed)
+        return self.window - elapsed
+
+    def reset(self, key):
+        with self._lock:
+            self._data.pop(key, None)
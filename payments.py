@@ -0,0 +1,83 @@
+"""Razorpay gateway plumbing: a pooled HTTP session with bounded timeouts and
+retries, and a small worker pool that keeps gateway calls off request threads"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import razorpay
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class GatewayBusy(Exception):
+    """Raised when the gateway worker pool already has its maximum of pending calls"""
+
+
+class TimeoutSession(requests.Session):
+    """requests.Session that applies a default (connect, read) timeout to every call"""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def build_session(connect_timeout=3.0, read_timeout=10.0, retries=2, backoff=0.5, pool_size=10):
+    """Session with keep-alive connection pooling, timeouts and retry with backoff.
+
+    Connection failures are always retried since the request never reached the
+    gateway. Responses are only retried on 429/503, which Razorpay returns
+    before doing any work, so order creation is never duplicated.
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        status_forcelist=(429, 503),
+        allowed_methods=None,
+        backoff_factor=backoff,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = TimeoutSession((connect_timeout, read_timeout))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def create_client(key_id, key_secret, base_url=None, **session_options):
+    """Razorpay client that talks through a pooled, time-bounded session"""
+    options = {'base_url': base_url} if base_url else {}
+    return razorpay.Client(session=build_session(**session_options),
+                           auth=(key_id, key_secret), **options)
+
+
+class GatewayPool:
+    """Thread pool for gateway calls with a cap on queued work.
+
+    ``submit`` fails fast with GatewayBusy once ``max_pending`` calls are queued
+    or running, so a slow provider backs up here instead of in the web workers.
+    """
+
+    def __init__(self, max_workers=4, max_pending=100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gateway')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise GatewayBusy('Payment gateway is busy')
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,143 @@
+"""Parsing and validation for bulk product imports.
+
+``read_rows`` stream-parses CSV or JSON Lines one record at a time and
+``validate_row`` turns a raw record into clean column values or an error
+message, so a file of any size is checked row by row with constant memory.
+Writing the rows is left to the caller.
+
+Only the columns a record fills in are returned, so re-importing a file with
+fewer columns, or blank cells, updates just the rest; ``DEFAULTS`` fill the
+gaps for new products.
+"""
+import csv
+import json
+import math
+
+FORMATS = ('csv', 'jsonl')
+MAX_REPORTED_ERRORS = 1000
+REQUIRED = ('sku', 'name', 'category', 'price')
+# Values for optional columns a new product's record leaves out
+DEFAULTS = {'description': '', 'image': '', 'discount_price': None, 'stock': 10, 'rating': 4.0}
+
+
+class ImportReport:
+    """Counts and per-row errors for one import run"""
+
+    def __init__(self, max_errors=MAX_REPORTED_ERRORS):
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def error(self, line, message, rows=1):
+        """Record a rejected row (or ``rows`` rows sharing one message)"""
+        self.failed += rows
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, message))
+
+    @property
+    def imported(self):
+        return self.inserted + self.updated
+
+    def summary(self):
+        return f'{self.inserted} added, {self.updated} updated, {self.failed} rejected'
+
+
+def detect_format(filename):
+    """'csv' or 'jsonl' from a file name, or None"""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return None
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line_number, record_or_None, error_or_None)`` from a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f'Invalid JSON: {e}'
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, 'Expected a JSON object'
+                continue
+            yield line_number, record, None
+    else:
+        raise ValueError(f'Unsupported import format: {fmt}')
+
+
+def _text(record, key, max_length, required=False):
+    value = record.get(key)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'{key} is required')
+    if len(value) > max_length:
+        raise ValueError(f'{key} is longer than {max_length} characters')
+    return value or None
+
+
+def _blank(value):
+    return value is None or str(value).strip() == ''
+
+
+def _number(record, key, cast, required=False):
+    value = record.get(key)
+    if _blank(value):
+        if required:
+            raise ValueError(f'{key} is required')
+        return None
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{key} must be a number, got {value!r}')
+    if not math.isfinite(number):
+        raise ValueError(f'{key} must be a finite number')
+    return number
+
+
+def validate_row(record, categories):
+    """Return ``(values, None)`` for a valid record or ``(None, message)``.
+
+    ``values`` holds the required columns and any other column the record
+    fills in; a missing or blank optional column is left out, so an update
+    keeps the product's current value for it.
+    """
+    parsers = {
+        'sku': lambda: _text(record, 'sku', 64, required=True),
+        'name': lambda: _text(record, 'name', 100, required=True),
+        'description': lambda: _text(record, 'description', 10000),
+        'category': lambda: _text(record, 'category', 50, required=True),
+        'image': lambda: _text(record, 'image', 500),
+        'price': lambda: _number(record, 'price', float, required=True),
+        'discount_price': lambda: _number(record, 'discount_price', float),
+        'stock': lambda: _number(record, 'stock', int),
+        'rating': lambda: _number(record, 'rating', float),
+    }
+    try:
+        values = {key: parse() for key, parse in parsers.items()
+                  if key in REQUIRED or not _blank(record.get(key))}
+    except ValueError as e:
+        return None, str(e)
+
+    if values['category'] not in categories:
+        return None, f"category must be one of {', '.join(categories)}"
+    if values['price'] <= 0:
+        return None, 'price must be positive'
+    if values.get('discount_price') is not None and not 0 < values['discount_price'] < values['price']:
+        return None, 'discount_price must be between 0 and price'
+    if values.get('stock', 0) < 0:
+        return None, 'stock cannot be negative'
+    if not 0 <= values.get('rating', 0) <= 5:
+        return None, 'rating must be between 0 and 5'
+    return values, None
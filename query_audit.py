@@ -0,0 +1,86 @@
+"""Query plan audit for SQLite.
+
+``capture_statements`` records every SELECT an engine runs while a block of
+code executes; ``audit_statements`` then asks SQLite for the plan of each one
+with ``EXPLAIN QUERY PLAN`` and reports the steps that read a whole table.
+Run it over the queries behind each route to catch a missing index before it
+reaches production.
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+@contextmanager
+def capture_statements(engine):
+    """Collect the distinct (statement, parameters) SELECTs run on ``engine`` inside the block"""
+    captured = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and statement not in captured:
+            captured[statement] = parameters
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield captured
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def explain(conn, statement, parameters=()):
+    """Return the ``detail`` column of SQLite's query plan for a statement"""
+    rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan, statement=''):
+    """Plan steps that read a whole table rather than searching an index.
+
+    A ``SCAN`` walks every row even when it goes through an index (to get them
+    in order, or from a covering index); only a ``SEARCH`` narrows the rows
+    read. Scans of FTS virtual tables and of SQLite's own catalog are
+    excluded. ``USE TEMP B-TREE FOR ORDER BY`` is reported too, since it means
+    every matching row is sorted before the LIMIT applies; sorting the rows of
+    an IN list (an eager load) or ranking FTS matches is expected.
+    """
+    expected_sort = ' IN (' in statement or any('VIRTUAL TABLE' in detail for detail in plan)
+    flagged = []
+    for detail in plan:
+        if detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail:
+            if scanned_table(detail) != 'sqlite_master':
+                flagged.append(detail)
+        elif 'TEMP B-TREE FOR ORDER BY' in detail and not expected_sort:
+            flagged.append(detail)
+    return flagged
+
+
+def scanned_table(detail):
+    """Table name from a ``SCAN <table>`` step, or None"""
+    if not detail.startswith('SCAN '):
+        return None
+    return detail.split()[1]
+
+
+def is_bounded(statement, plan):
+    """True for an unfiltered ``SELECT ... LIMIT n`` that reads rows in table or
+    index order without sorting, so its scan stops after the first n rows"""
+    upper = ' '.join(statement.upper().split())
+    return (' LIMIT ' in upper
+            and not any(clause in upper for clause in (' WHERE ', ' JOIN ', ' GROUP BY '))
+            and not any('TEMP B-TREE' in detail for detail in plan))
+
+
+def audit_statements(engine, statements, allow=()):
+    """Explain each captured statement; returns [(statement, plan, flagged)].
+
+    Steps that scan a table listed in ``allow`` are not flagged, for queries
+    that read a whole (small) table on purpose, and neither are bounded scans.
+    """
+    results = []
+    with engine.connect() as conn:
+        for statement, parameters in statements.items():
+            plan = explain(conn, statement, parameters)
+            flagged = [] if is_bounded(statement, plan) else [
+                detail for detail in full_scans(plan, statement) if scanned_table(detail) not in allow]
+            results.append((statement, plan, flagged))
+    return results
@@ -1,12 +1,10 @@
-import os
-from app import db, app
+from app import app, drop_database, migrate_database, seed_database
 
 with app.app_context():
-    # Delete database file
-    if os.path.exists('shop.db'):
-        os.remove('shop.db')
-        print("✅ Database deleted")
+    # Drop every table and recreate the schema
+    drop_database()
+    print("✅ Database deleted")
     
-    # Recreate database
-    db.create_all()
+    migrate_database()
+    seed_database()
     print("✅ New database created")
\ No newline at end of file
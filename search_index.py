@@ -0,0 +1,149 @@
+"""Full-text product search backed by an SQLite FTS5 index.
+
+The ``product_search`` virtual table mirrors the name, description and
+category of every row in ``product``. Triggers on ``product`` keep it in step
+with inserts, updates and deletes, so any write path (admin forms, bulk
+imports, the shell) updates the index in the same transaction.
+"""
+import re
+
+from sqlalchemy import false, text
+
+FTS_TABLE = 'product_search'
+
+# Column weights for bm25(): a hit in the name counts most
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.0
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, category,
+        content='product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description, category ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+]
+
+
+def is_supported(engine):
+    """True if the database can host the FTS5 index"""
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as conn:
+        options = [row[0] for row in conn.execute(text('PRAGMA compile_options'))]
+    return 'ENABLE_FTS5' in options
+
+
+def is_installed(engine):
+    """True if the index table exists in the database"""
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                           {'name': FTS_TABLE}).first()
+    return row is not None
+
+
+def install(engine):
+    """Create the index and its triggers if missing, then rebuild it.
+
+    Returns False (and does nothing) when FTS5 is not available.
+    """
+    if not is_supported(engine):
+        return False
+    with engine.begin() as conn:
+        for statement in _DDL:
+            conn.execute(text(statement))
+    rebuild(engine)
+    return True
+
+
+def drop(engine):
+    """Remove the index and its triggers"""
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as conn:
+        for suffix in ('ai', 'ad', 'au'):
+            conn.execute(text(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}'))
+        conn.execute(text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
+
+
+def rebuild(engine):
+    """Re-read every product row into the index"""
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def build_match_query(term):
+    """Turn free text into an FTS5 query where every word is a quoted prefix.
+
+    Quoting keeps user input from being parsed as FTS5 syntax. Returns None
+    if the term has no searchable words.
+    """
+    tokens = _TOKEN_RE.findall(term or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def match_condition(term):
+    """A WHERE condition on ``product.id`` for rows matching ``term``"""
+    match = build_match_query(term)
+    if match is None:
+        return false()
+    return text(f'product.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match)'
+                ).bindparams(match=match)
+
+
+def search_product_ids(conn, term, category=None, min_price=None, max_price=None, min_rating=None,
+                       in_stock=False, limit=20, offset=0):
+    """Return product ids matching ``term``, best match first
+
+    Price filters select [min_price, max_price), as filter_products() does.
+    """
+    match = build_match_query(term)
+    if match is None:
+        return []
+
+    sql = f"""
+        SELECT {FTS_TABLE}.rowid
+        FROM {FTS_TABLE}
+        JOIN product ON product.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :match
+    """
+    params = {'match': match, 'limit': limit, 'offset': offset}
+    if category:
+        sql += ' AND product.category = :category'
+        params['category'] = category
+    if min_price is not None:
+        sql += ' AND product.effective_price >= :min_price'
+        params['min_price'] = min_price
+    if max_price is not None:
+        sql += ' AND product.effective_price < :max_price'
+        params['max_price'] = max_price
+    if min_rating is not None:
+        sql += ' AND product.rating >= :min_rating'
+        params['min_rating'] = min_rating
+    if in_stock:
+        sql += ' AND product.stock > 0'
+    sql += f"""
+        ORDER BY bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}, {CATEGORY_WEIGHT}), {FTS_TABLE}.rowid
+        LIMIT :limit OFFSET :offset
+    """
+    return [row[0] for row in conn.execute(text(sql), params)]
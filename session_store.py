@@ -0,0 +1,163 @@
+"""Server-side cart storage.
+
+Carts live on the server under a short key and only that key travels in the
+session cookie, so request and response sizes stay constant however large the
+cart grows. Two backends are provided:
+
+* ``SQLiteCartStore`` - a file shared by every worker process on the host
+* ``MemoryCartStore`` - a per-process LRU, for tests and single-worker setups
+
+``create_store()`` picks one from a URL such as ``sqlite:///instance/carts.db``
+or ``memory://?maxsize=10000``.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+
+class CartStore:
+    """Interface shared by the cart backends; carts are ``{product_id: quantity}`` dicts"""
+
+    def __init__(self, ttl=30 * 24 * 3600):
+        self.ttl = ttl
+
+    def get(self, key):
+        """Return the cart stored under ``key`` or None if missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key, cart):
+        """Store ``cart`` under ``key`` and restart its expiry clock"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def sweep(self):
+        """Remove expired carts; returns how many were removed"""
+        raise NotImplementedError
+
+    def merge(self, source_key, target_key):
+        """Add the quantities of the cart at ``source_key`` into ``target_key``.
+
+        The source cart is deleted. Returns the merged target cart.
+        """
+        source = self.get(source_key)
+        target = self.get(target_key) or {}
+        if source:
+            for product_id, quantity in source.items():
+                target[product_id] = target.get(product_id, 0) + quantity
+            self.set(target_key, target)
+            self.delete(source_key)
+        return target
+
+
+class MemoryCartStore(CartStore):
+    """Thread-safe in-process store that evicts the least recently used cart"""
+
+    def __init__(self, maxsize=10000, ttl=30 * 24 * 3600, clock=time.time):
+        super().__init__(ttl)
+        self.maxsize = maxsize
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, cart = entry
+            if expires_at <= self._clock():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return dict(cart)
+
+    def set(self, key, cart):
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, dict(cart))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def sweep(self):
+        now = self._clock()
+        with self._lock:
+            expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+
+class SQLiteCartStore(CartStore):
+    """Store backed by an SQLite file in WAL mode, safe across processes.
+
+    Expired rows are ignored on read and removed by ``sweep()``, which also
+    runs automatically every ``sweep_every`` writes.
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600, sweep_every=1000, clock=time.time):
+        super().__init__(ttl)
+        self.path = path
+        self.sweep_every = sweep_every
+        self._clock = clock
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cart ('
+                         'key TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cart_expires_at ON cart (expires_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute('SELECT data FROM cart WHERE key = ? AND expires_at > ?',
+                                      (key, self._clock())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, cart):
+        with self._connect() as conn:
+            conn.execute('INSERT INTO cart (key, data, expires_at) VALUES (?, ?, ?) '
+                         'ON CONFLICT(key) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at',
+                         (key, json.dumps(cart, separators=(',', ':')), self._clock() + self.ttl))
+        self._writes += 1
+        if self.sweep_every and self._writes % self.sweep_every == 0:
+            self.sweep()
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cart WHERE key = ?', (key,))
+
+    def sweep(self):
+        with self._connect() as conn:
+            return conn.execute('DELETE FROM cart WHERE expires_at <= ?', (self._clock(),)).rowcount
+
+
+def create_store(url, ttl=30 * 24 * 3600):
+    """Build a cart store from ``sqlite:///path`` or ``memory://?maxsize=N``"""
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        options = parse_qs(parsed.query)
+        maxsize = int(options.get('maxsize', ['10000'])[0])
+        return MemoryCartStore(maxsize=maxsize, ttl=ttl)
+    if parsed.scheme == 'sqlite':
+        return SQLiteCartStore(url[len('sqlite:///'):], ttl=ttl)
+    raise ValueError(f'Unsupported cart store URL: {url}')
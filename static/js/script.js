@@ -1,26 +1,66 @@
 // Shopping Cart Functions
-function updateCart(productId, action) {
-    fetch('/update-cart', {
+// Sends one change or a list of changes ({product_id, delta} or {product_id, quantity})
+// to the JSON API; the reply holds only the changed lines, the total and the count
+function changeCart(changes) {
+    return fetch('/api/v1/cart', {
         method: 'POST',
         headers: {
-            'Content-Type': 'application/x-www-form-urlencoded',
+            'Content-Type': 'application/json',
         },
-        body: `product_id=${productId}&action=${action}`
+        body: JSON.stringify(Array.isArray(changes) ? {changes: changes} : changes)
     })
     .then(response => response.json())
     .then(data => {
         if (data.success) {
-            // Update cart count in navbar
             const cartCount = document.querySelector('.cart-count');
             if (cartCount) {
-                cartCount.textContent = data.cart_count;
+                cartCount.textContent = data.count;
             }
-            
-            // Reload page to update cart
-            setTimeout(() => {
-                location.reload();
-            }, 300);
         }
+        return data;
+    });
+}
+
+function formatPrice(value) {
+    return '\u20B9' + Math.round(value * 100) / 100;
+}
+
+function updateCart(productId, action) {
+    const changes = {
+        increase: {product_id: productId, delta: 1},
+        decrease: {product_id: productId, delta: -1},
+        remove: {product_id: productId, quantity: 0}
+    };
+    changeCart(changes[action]).then(data => {
+        if (!data.success) {
+            alert(data.message);
+            return;
+        }
+        if (data.count === 0) {
+            // Show the empty cart page
+            location.reload();
+            return;
+        }
+        
+        // Patch the changed lines and the summary in place
+        data.lines.forEach(line => {
+            const row = document.querySelector(`.cart-item[data-product-id="${line.id}"]`);
+            if (!row) return;
+            if (line.quantity === 0) {
+                row.remove();
+            } else {
+                row.querySelector('.quantity').textContent = line.quantity;
+                row.querySelector('.cart-line-total').textContent = formatPrice(line.total);
+            }
+        });
+        const fields = {'.cart-subtotal': data.total, '.cart-tax': data.total * 0.18,
+                        '.cart-grand-total': data.total * 1.18};
+        Object.entries(fields).forEach(([selector, value]) => {
+            const element = document.querySelector(selector);
+            if (element) {
+                element.textContent = formatPrice(value);
+            }
+        });
     });
 }
 
@@ -53,58 +93,85 @@ function proceedToPayment() {
         method: 'POST'
     })
     .then(response => response.json())
-    .then(data => {
-        if (data.success) {
-            const options = {
-                key: data.key,
-                amount: data.amount,
-                currency: data.currency,
-                name: data.name,
-                description: data.description,
-                order_id: data.order_id,
-                handler: function(response) {
-                    // Submit payment success form
-                    const form = document.createElement('form');
-                    form.method = 'POST';
-                    form.action = '/payment-success';
-                    
-                    const paymentId = document.createElement('input');
-                    paymentId.type = 'hidden';
-                    paymentId.name = 'razorpay_payment_id';
-                    paymentId.value = response.razorpay_payment_id;
-                    
-                    const orderId = document.createElement('input');
-                    orderId.type = 'hidden';
-                    orderId.name = 'razorpay_order_id';
-                    orderId.value = response.razorpay_order_id;
-                    
-                    form.appendChild(paymentId);
-                    form.appendChild(orderId);
-                    document.body.appendChild(form);
-                    form.submit();
-                },
-                prefill: {
-                    name: data.user.name,
-                    email: data.user.email,
-                    contact: data.user.phone || '9999999999'
-                },
-                theme: {
-                    color: '#3b82f6'
-                }
-            };
-            
-            const rzp = new Razorpay(options);
-            rzp.open();
-        } else {
-            alert(data.message);
-        }
-    })
+    .then(handleOrderResponse)
     .catch(error => {
         console.error('Error:', error);
         alert('Error creating order');
     });
 }
 
+// The gateway order may be created in the background; poll until it is ready
+function handleOrderResponse(data, attempt = 0) {
+    if (data.success && data.pending) {
+        if (attempt >= 60) {
+            alert('Payment service is taking too long. Please try again.');
+            return;
+        }
+        setTimeout(() => {
+            fetch(data.status_url)
+                .then(response => response.json())
+                .then(next => handleOrderResponse(next, attempt + 1))
+                .catch(error => {
+                    console.error('Error:', error);
+                    alert('Error creating order');
+                });
+        }, 500);
+        return;
+    }
+    openCheckout(data);
+}
+
+function openCheckout(data) {
+    if (data.success) {
+        const options = {
+            key: data.key,
+            amount: data.amount,
+            currency: data.currency,
+            name: data.name,
+            description: data.description,
+            order_id: data.order_id,
+            handler: function(response) {
+                // Submit payment success form
+                const form = document.createElement('form');
+                form.method = 'POST';
+                form.action = '/payment-success';
+                
+                const paymentId = document.createElement('input');
+                paymentId.type = 'hidden';
+                paymentId.name = 'razorpay_payment_id';
+                paymentId.value = response.razorpay_payment_id;
+                
+                const orderId = document.createElement('input');
+                orderId.type = 'hidden';
+                orderId.name = 'razorpay_order_id';
+                orderId.value = response.razorpay_order_id;
+                
+                form.appendChild(paymentId);
+                form.appendChild(orderId);
+                document.body.appendChild(form);
+                form.submit();
+            },
+            prefill: {
+                name: data.user.name,
+                email: data.user.email,
+                contact: data.user.phone || '9999999999'
+            },
+            theme: {
+                color: '#3b82f6'
+            }
+        };
+        
+        const rzp = new Razorpay(options);
+        rzp.on('payment.failed', function() {
+            // Release the stock held for this order
+            location.href = '/payment-failed?order_id=' + encodeURIComponent(data.receipt);
+        });
+        rzp.open();
+    } else {
+        alert(data.message);
+    }
+}
+
 // Form Validation
 function validateForm(formId) {
     const form = document.getElementById(formId);
@@ -171,17 +238,9 @@ document.addEventListener('DOMContentLoaded', function() {
         button.addEventListener('click', function(e) {
             e.preventDefault();
             const productId = this.dataset.productId;
-            fetch(`/add-to-cart/${productId}`)
-                .then(() => {
-                    // Update cart count
-                    const cartCount = document.querySelector('.cart-count');
-                    if (cartCount) {
-                        const current = parseInt(cartCount.textContent) || 0;
-                        cartCount.textContent = current + 1;
-                    }
-                    
-                    // Show success message
-                    alert('Product added to cart!');
+            changeCart({product_id: productId, delta: 1})
+                .then(data => {
+                    alert(data.success ? 'Product added to cart!' : data.message);
                 });
         });
     });
@@ -0,0 +1,93 @@
+"""Local stand-in for the Razorpay orders API, for development, tests and benchmarks.
+
+Run it and point the shop at it:
+
+    python stub_gateway.py --port 9000 --delay 0.2
+    RAZORPAY_BASE_URL=http://127.0.0.1:9000 python app.py
+
+``--delay`` simulates a slow provider and ``--fail-rate`` makes a share of
+calls return a 503 so the retry and release paths can be exercised.
+"""
+import argparse
+import itertools
+import json
+import random
+import secrets
+import threading
+import time
+
+from werkzeug.serving import run_simple
+from werkzeug.wrappers import Request, Response
+
+
+class StubGateway:
+    """WSGI app answering POST /v1/orders and GET /v1/orders/<id> like Razorpay"""
+
+    def __init__(self, delay=0.0, fail_rate=0.0):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.orders = {}
+        self.calls = 0
+        self._ids = itertools.count(1)
+        # Unique per instance so ids never repeat across restarts against one database
+        self._prefix = secrets.token_hex(3)
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        with self._lock:
+            self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail_rate and random.random() < self.fail_rate:
+            return self._json({'error': {'code': 'SERVER_ERROR', 'description': 'Stub failure'}},
+                              503)(environ, start_response)
+
+        if request.method == 'POST' and request.path == '/v1/orders':
+            data = request.get_json(silent=True) or request.form.to_dict()
+            with self._lock:
+                order_id = f'order_{self._prefix}{next(self._ids):08d}'
+                order = {
+                    'id': order_id,
+                    'entity': 'order',
+                    'amount': int(data.get('amount', 0)),
+                    'currency': data.get('currency', 'INR'),
+                    'receipt': data.get('receipt'),
+                    'status': 'created',
+                    'created_at': int(time.time())
+                }
+                self.orders[order_id] = order
+            return self._json(order)(environ, start_response)
+
+        if request.method == 'GET' and request.path.startswith('/v1/orders/'):
+            order = self.orders.get(request.path.rsplit('/', 1)[-1])
+            if order:
+                return self._json(order)(environ, start_response)
+
+        return self._json({'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'Not found'}},
+                          404)(environ, start_response)
+
+    @staticmethod
+    def _json(payload, status=200):
+        return Response(json.dumps(payload), status=status, mimetype='application/json')
+
+
+def serve_in_thread(host='127.0.0.1', port=0, **options):
+    """Start a stub gateway on a background thread; returns (base_url, gateway, server)"""
+    from werkzeug.serving import make_server
+
+    gateway = StubGateway(**options)
+    server = make_server(host, port, gateway, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://{host}:{server.server_port}', gateway, server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stub Razorpay orders API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of calls answered with 503')
+    args = parser.parse_args()
+    run_simple(args.host, args.port, StubGateway(delay=args.delay, fail_rate=args.fail_rate),
+               threaded=True)
@@ -0,0 +1,197 @@
+"""Durable background jobs for work that can happen after the response.
+
+Jobs are rows in an SQLite file in WAL mode, so they survive restarts and are
+shared by every worker process on the host. A small pool of threads claims due
+jobs, runs the registered handler and deletes the row on success. A failed job
+is retried with exponential backoff up to ``max_attempts`` times, then kept
+with its last error until ``retry_failed()``.
+
+Claiming a job leases it by pushing its ``run_at`` forward by ``lease``
+seconds; if the worker dies mid-job the lease runs out and another worker picks
+it up. Jobs therefore run at least once and handlers must be idempotent.
+
+    queue = TaskQueue('instance/tasks.db', context=app.app_context)
+
+    @queue.task('send_receipt')
+    def send_receipt(order_id): ...
+
+    queue.enqueue('send_receipt', order_id=42)
+"""
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TaskQueue:
+    """SQLite-backed job queue with an in-process thread pool.
+
+    Nothing touches the disk or starts a thread until the first ``enqueue``,
+    ``run_pending`` or ``start``. With ``workers=0`` jobs are only run by
+    ``run_pending()``, e.g. from a separate worker process or a cron job.
+    """
+
+    def __init__(self, path, workers=2, max_attempts=5, backoff=2.0, lease=300, poll_interval=1.0,
+                 context=None, clock=time.time):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._context = context or contextlib.nullcontext
+        self._clock = clock
+        self._handlers = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ready = False
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def task(self, name):
+        """Decorator registering a handler; it is called with the enqueued keyword arguments"""
+        def decorator(fn):
+            self._handlers[name] = fn
+            return fn
+        return decorator
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._lock:
+                if not self._ready:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    with sqlite3.connect(self.path, timeout=5.0) as setup:
+                        setup.execute('PRAGMA journal_mode=WAL')
+                        setup.execute('CREATE TABLE IF NOT EXISTS task ('
+                                      'id INTEGER PRIMARY KEY, name TEXT NOT NULL, payload TEXT NOT NULL, '
+                                      'attempts INTEGER NOT NULL DEFAULT 0, run_at REAL NOT NULL, '
+                                      'failed_at REAL, last_error TEXT, created_at REAL NOT NULL)')
+                        setup.execute('CREATE INDEX IF NOT EXISTS ix_task_due ON task (failed_at, run_at)')
+                    setup.close()
+                    self._ready = True
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, name, delay=0, **payload):
+        """Store a job for the handler ``name``; it runs after ``delay`` seconds at the earliest"""
+        if name not in self._handlers:
+            raise KeyError(f'No task handler registered as {name!r}')
+        now = self._clock()
+        with self._connect() as conn:
+            task_id = conn.execute('INSERT INTO task (name, payload, run_at, created_at) VALUES (?, ?, ?, ?)',
+                                   (name, json.dumps(payload), now + delay, now)).lastrowid
+        self.start()
+        self._wakeup.set()
+        return task_id
+
+    def _claim(self):
+        now = self._clock()
+        with self._connect() as conn:
+            rows = conn.execute(
+                'UPDATE task SET run_at = ?, attempts = attempts + 1 WHERE id = ('
+                'SELECT id FROM task WHERE failed_at IS NULL AND run_at <= ? ORDER BY run_at LIMIT 1) '
+                'RETURNING id, name, payload, attempts', (now + self.lease, now)).fetchall()
+        return rows[0] if rows else None
+
+    def _run(self, job):
+        task_id, name, payload, attempts = job
+        try:
+            handler = self._handlers[name]
+            with self._context():
+                handler(**json.loads(payload))
+        except Exception as e:
+            now = self._clock()
+            error = f'{type(e).__name__}: {e}'
+            with self._connect() as conn:
+                if attempts >= self.max_attempts:
+                    logger.exception('Task %s #%d failed for good after %d attempts', name, task_id, attempts)
+                    conn.execute('UPDATE task SET failed_at = ?, last_error = ? WHERE id = ?',
+                                 (now, error, task_id))
+                else:
+                    logger.warning('Task %s #%d failed (attempt %d), retrying: %s', name, task_id, attempts, error)
+                    conn.execute('UPDATE task SET run_at = ?, last_error = ? WHERE id = ?',
+                                 (now + self.backoff * 2 ** (attempts - 1), error, task_id))
+            return False
+        with self._connect() as conn:
+            conn.execute('DELETE FROM task WHERE id = ?', (task_id,))
+        return True
+
+    def run_pending(self, limit=None):
+        """Run due jobs in the calling thread until none are left; returns how many ran"""
+        ran = 0
+        while limit is None or ran < limit:
+            job = self._claim()
+            if job is None:
+                break
+            self._run(job)
+            ran += 1
+        return ran
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+                if job is not None:
+                    self._run(job)
+                    continue
+            except sqlite3.Error:
+                logger.exception('Task queue database error')
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Start the worker threads if they are not running yet"""
+        if self._threads or not self.workers:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'task-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Ask the workers to finish their current job and exit"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        """Counts of due jobs, jobs waiting on a delay, retry or lease, and failed jobs"""
+        row = self._connect().execute(
+            'SELECT COALESCE(SUM(failed_at IS NULL AND run_at <= ?), 0), '
+            'COALESCE(SUM(failed_at IS NULL AND run_at > ?), 0), '
+            'COALESCE(SUM(failed_at IS NOT NULL), 0) FROM task', (self._clock(),) * 2).fetchone()
+        return {'due': row[0], 'scheduled': row[1], 'failed': row[2]}
+
+    def failed(self, limit=50):
+        """The most recent jobs that ran out of attempts, as dicts"""
+        rows = self._connect().execute(
+            'SELECT id, name, payload, attempts, last_error, failed_at FROM task '
+            'WHERE failed_at IS NOT NULL ORDER BY failed_at DESC LIMIT ?', (limit,)).fetchall()
+        return [{'id': task_id, 'name': name, 'payload': json.loads(payload), 'attempts': attempts,
+                 'error': error, 'failed_at': failed_at}
+                for task_id, name, payload, attempts, error, failed_at in rows]
+
+    def retry_failed(self):
+        """Give every failed job a fresh set of attempts; returns how many"""
+        with self._connect() as conn:
+            count = conn.execute('UPDATE task SET failed_at = NULL, attempts = 0, run_at = ? '
+                                 'WHERE failed_at IS NOT NULL', (self._clock(),)).rowcount
+        self._wakeup.set()
+        return count
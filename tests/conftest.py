@@ -0,0 +1,77 @@
+"""Shared fixtures: the app on a throwaway database, talking to the stub gateway.
+
+The app reads its configuration at import time, so the environment is set up
+here before ``app`` is first imported.
+"""
+import logging
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_gateway import serve_in_thread  # noqa: E402
+
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+GATEWAY_URL, GATEWAY, _server = serve_in_thread()
+_workdir = tempfile.mkdtemp(prefix='shop-tests-')
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(_workdir, 'shop.db')}",
+    TASK_QUEUE_PATH=os.path.join(_workdir, 'tasks.db'),
+    TASK_WORKERS='0',
+    CART_STORE='memory://',
+    RAZORPAY_BASE_URL=GATEWAY_URL,
+    RAZORPAY_RETRIES='0',
+    RAZORPAY_READ_TIMEOUT='0.5'
+)
+
+
+@pytest.fixture(scope='session')
+def shop():
+    import app as shop
+    with shop.app.app_context():
+        shop.migrate_database()
+        shop.seed_database()
+    return shop
+
+
+@pytest.fixture
+def gateway():
+    """The stub gateway, back to instant, error-free answers after each test"""
+    yield GATEWAY
+    GATEWAY.delay = 0.0
+    GATEWAY.fail_rate = 0.0
+
+
+@pytest.fixture
+def customer(shop):
+    with shop.app.app_context():
+        user = shop.User.query.filter_by(email='buyer@example.com').first()
+        if user is None:
+            user = shop.User(name='Buyer', email='buyer@example.com', password='unused')
+            shop.db.session.add(user)
+            shop.db.session.commit()
+        return {'user_id': user.id, 'user_name': user.name, 'user_email': user.email, 'is_admin': False}
+
+
+@pytest.fixture
+def client(shop, customer):
+    """Test client logged in as the customer"""
+    client = shop.app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(customer)
+    return client
+
+
+@pytest.fixture
+def admin(shop):
+    """Test client logged in as the seeded admin"""
+    client = shop.app.test_client()
+    with shop.app.app_context():
+        user = shop.User.query.filter_by(email='admin@shop.com').one()
+        session = {'user_id': user.id, 'user_name': user.name, 'user_email': user.email, 'is_admin': True}
+    with client.session_transaction() as sess:
+        sess.update(session)
+    return client
@@ -0,0 +1,57 @@
+"""Streaming CSV and JSON exports"""
+import csv
+import io
+import json
+from datetime import datetime
+
+import exports
+
+COLUMNS = ['id', 'name', 'created_at']
+ROWS = [(n, f'Item {n}', datetime(2024, 1, n)) for n in range(1, 6)]
+
+
+def test_csv_is_streamed_in_chunks():
+    chunks = list(exports.stream_csv(COLUMNS, iter(ROWS), chunk_rows=2))
+
+    assert len(chunks) == 3
+    rows = list(csv.reader(io.StringIO(''.join(chunks))))
+    assert rows[0] == COLUMNS
+    assert rows[1:] == [[str(n), f'Item {n}', f'2024-01-0{n}T00:00:00'] for n in range(1, 6)]
+
+
+def test_json_is_one_array_across_chunks():
+    chunks = list(exports.stream_json(COLUMNS, iter(ROWS), chunk_rows=2))
+
+    assert len(chunks) == 3
+    assert json.loads(''.join(chunks))[-1] == {'id': 5, 'name': 'Item 5', 'created_at': '2024-01-05T00:00:00'}
+    assert json.loads(''.join(exports.stream_json(COLUMNS, iter([])))) == []
+
+
+def test_admin_export_lists_every_product(shop, admin):
+    response = admin.get('/admin/export/products.csv')
+
+    assert response.mimetype == 'text/csv'
+    assert 'attachment; filename=products-' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    with shop.app.app_context():
+        assert [int(row['id']) for row in rows] == [p.id for p in shop.Product.query.order_by(shop.Product.id)]
+
+
+def test_order_export_filters_by_status(shop, admin):
+    with shop.app.app_context():
+        shop.db.session.add_all([shop.Order(order_id=f'EXPORT{n:08d}', user_email='export@example.com',
+                                            total=100, status=status)
+                                 for n, status in enumerate(['Cancelled', 'Paid', 'Cancelled'])])
+        shop.db.session.commit()
+
+    response = admin.get('/admin/export/orders.json?status=Cancelled&since=2000-01-01')
+
+    orders = json.loads(response.get_data(as_text=True))
+    with shop.app.app_context():
+        expected = shop.Order.query.filter_by(status='Cancelled').count()
+    assert len(orders) == expected >= 2
+    assert all(order['status'] == 'Cancelled' for order in orders)
+
+
+def test_export_requires_an_admin(client):
+    assert client.get('/admin/export/orders.csv').status_code == 302
@@ -0,0 +1,38 @@
+"""Facet counts on /products agree with the listings their links open"""
+import io
+from urllib.parse import urlencode
+
+
+def walk(client, **args):
+    """Ids of every product the API lists for ``args``, following next_cursor"""
+    ids, cursor = [], None
+    while True:
+        query = dict(args, per_page=50, **({'cursor': cursor} if cursor else {}))
+        page = client.get(f'/api/v1/products?{urlencode(query)}').get_json()
+        ids += [item['id'] for item in page['items']]
+        cursor = page['next_cursor']
+        if not cursor:
+            return ids
+
+
+def test_every_facet_count_matches_the_listing_it_links_to(shop):
+    with shop.app.app_context():
+        # A price right on a bucket boundary belongs to the bucket above it
+        report = shop.import_products(io.StringIO(
+            '{"sku": "EDGE-5000", "name": "Boundary Kettle", "category": "Home", "price": 5000}\n'), 'jsonl')
+        assert report.imported == 1, report.errors
+        facets = shop.count_facets()
+        word = shop.db.session.get(shop.Product, 1).name.split()[0]
+        search_facets = shop.count_facets(word)
+    client = shop.app.test_client()
+
+    assert len(walk(client)) == facets['total']
+    for category, count in facets['categories']:
+        assert len(walk(client, category=category)) == count, category
+    for low, high, count in facets['prices']:
+        bounds = {key: value for key, value in (('min_price', low), ('max_price', high)) if value is not None}
+        assert len(walk(client, **bounds)) == count, (low, high)
+    for band, count in facets['ratings']:
+        assert len(walk(client, min_rating=band)) == count, band
+    assert len(walk(client, in_stock=1)) == facets['in_stock']
+    assert len(walk(client, search=word)) == search_facets['total'] > 0
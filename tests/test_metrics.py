@@ -0,0 +1,59 @@
+"""Dashboard summary tables and per-customer order summaries"""
+import threading
+from datetime import date
+
+
+def test_concurrent_increments_of_a_new_row_all_count(shop):
+    day = date(1999, 12, 31)
+    errors = []
+
+    def add_order():
+        try:
+            with shop.app.app_context():
+                shop._increment(shop.DailySales, {'day': day}, orders=1, revenue=10.0)
+                shop.db.session.commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add_order) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with shop.app.app_context():
+        row = shop.db.session.get(shop.DailySales, day)
+        assert (row.orders, row.revenue) == (8, 80.0)
+
+
+def summary(shop, email):
+    with shop.app.app_context():
+        row = shop.db.session.get(shop.OrderSummary, email)
+        return {column.key: getattr(row, column.key) for column in shop.OrderSummary.__table__.columns}
+
+
+def test_order_summary_follows_checkout_and_payment_and_matches_a_rebuild(shop, client, customer, gateway):
+    shop.app.config['RAZORPAY_ASYNC'] = False
+    try:
+        client.get('/api/clear-cart')
+        client.get('/add-to-cart/2')
+        result = client.post('/create-order').get_json()
+    finally:
+        shop.app.config['RAZORPAY_ASYNC'] = True
+    assert result['success'], result
+    email = customer['user_email']
+
+    created = summary(shop, email)
+    assert (created['last_order_id'], created['last_order_status']) == (result['receipt'], 'Created')
+
+    client.post('/payment-success', data={'razorpay_order_id': result['order_id'],
+                                          'razorpay_payment_id': 'pay_summary'})
+    paid = summary(shop, email)
+    assert paid['last_order_status'] == 'Paid'
+    assert paid['order_count'] == created['order_count']
+    assert paid['lifetime_spend'] == created['lifetime_spend'] + created['last_order_total']
+
+    with shop.app.app_context():
+        shop.rebuild_order_summaries()
+    assert summary(shop, email) == paid
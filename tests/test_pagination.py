@@ -0,0 +1,46 @@
+"""Keyset pagination of product and order listings"""
+import pytest
+
+
+def walk(client, url):
+    """Follow next_cursor from ``url`` to the end; returns every item in order"""
+    items, cursor = [], None
+    while True:
+        page = client.get(url + (f'&cursor={cursor}' if cursor else '')).get_json()
+        items += page['items']
+        cursor = page['next_cursor']
+        if not cursor:
+            return items
+
+
+@pytest.mark.parametrize('sort', ['', 'price_asc', 'price_desc', 'discount'])
+def test_product_pages_list_every_product_once_in_order(shop, sort):
+    items = walk(shop.app.test_client(), f'/api/v1/products?per_page=3&sort={sort}')
+
+    _, columns, descending = shop.PRODUCT_SORTS[sort]
+    with shop.app.app_context():
+        query = shop.Product.query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+        expected = [product.id for product in query]
+    assert [item['id'] for item in items] == expected
+
+
+def test_null_sort_key_does_not_restart_the_listing(shop):
+    with shop.app.app_context():
+        orders = [shop.Order(order_id=f'PAGE{n:010d}', user_email='pager@example.com', total=100,
+                             status='Paid') for n in range(5)]
+        shop.db.session.add_all(orders)
+        shop.db.session.commit()
+        # Legacy rows without a timestamp sort after every dated one
+        (shop.Order.query.filter(shop.Order.id.in_([orders[3].id, orders[4].id]))
+         .update({shop.Order.created_at: None}, synchronize_session=False))
+        shop.db.session.commit()
+
+        query = shop.Order.query.filter_by(user_email='pager@example.com')
+        columns = [shop.Order.created_at, shop.Order.id]
+        with shop.app.test_request_context():
+            first = shop.paginate_keyset(query, columns, page_size=4)
+            assert first['items'][-1].created_at is None and first['has_next']
+            second = shop.paginate_keyset(query, columns, first['next_cursor'], page_size=4)
+
+    assert second['cursor'] == first['next_cursor']
+    assert not {o.id for o in first['items']} & {o.id for o in second['items']}
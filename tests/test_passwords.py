@@ -0,0 +1,77 @@
+"""Password hashing pool and login rate limiting"""
+import time
+
+import pytest
+
+from passwords import HashPool, HashPoolBusy, SlidingWindowLimiter
+
+
+def test_timed_out_hash_keeps_its_slot_until_the_worker_finishes():
+    pool = HashPool(method='pbkdf2:sha256:1000000', workers=1, max_pending=1, timeout=0.05)
+    try:
+        with pytest.raises(HashPoolBusy, match='timed out'):
+            pool.hash('secret')
+        # The worker is still hashing, so the only slot is still taken
+        with pytest.raises(HashPoolBusy, match='Too many'):
+            pool.hash('secret')
+
+        pool.timeout = 10
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                assert pool.hash('secret').startswith(pool.full_method)
+                break
+            except HashPoolBusy:
+                assert time.monotonic() < deadline, 'slot was never released'
+                time.sleep(0.05)
+    finally:
+        pool.shutdown()
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_limiter_refuses_over_the_limit_and_slides_its_window():
+    clock = FakeClock()
+    limiter = SlidingWindowLimiter(3, 60, clock=clock)
+
+    assert [limiter.hit('ip') for _ in range(4)] == [True, True, True, False]
+    assert limiter.retry_after('ip') == 60
+    assert limiter.hit('other')
+
+    # Halfway into the next window only half of the previous window still counts
+    clock.now = 90
+    assert limiter.hit('ip')
+    assert not limiter.hit('ip')
+    assert 0 < limiter.retry_after('ip') <= 30
+
+
+def test_limiter_keeps_at_most_maxsize_keys():
+    limiter = SlidingWindowLimiter(1, 60, maxsize=2, clock=FakeClock())
+    for key in ('a', 'b', 'c'):
+        assert limiter.hit(key)
+
+    assert limiter.hit('a')  # evicted as least recently used, so counted afresh
+    assert not limiter.hit('c')
+
+
+def test_repeated_failed_logins_are_refused_with_retry_after(shop):
+    client = shop.app.test_client()
+    email = 'nobody@example.com'
+    try:
+        statuses = [client.post('/login', data={'email': email, 'password': 'wrong'}).status_code
+                    for _ in range(shop.app.config['LOGIN_EMAIL_LIMIT'] + 1)]
+        assert 429 not in statuses[:-1]
+        assert statuses[-1] == 429
+
+        response = client.post('/login', data={'email': email, 'password': 'wrong'})
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) > 0
+    finally:
+        shop.login_email_limiter.reset(email)
+        shop.auth_ip_limiter.reset('127.0.0.1')
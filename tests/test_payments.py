@@ -0,0 +1,177 @@
+"""Checkout against the stub gateway: order creation, failures and async polling"""
+import threading
+import time
+
+import pytest
+
+PRODUCT_ID = 1
+
+
+@pytest.fixture
+def sync_gateway(shop):
+    shop.app.config['RAZORPAY_ASYNC'] = False
+    yield
+    shop.app.config['RAZORPAY_ASYNC'] = True
+
+
+def stock(shop):
+    with shop.app.app_context():
+        return shop.db.session.get(shop.Product, PRODUCT_ID).stock
+
+
+def order_row(shop, receipt):
+    with shop.app.app_context():
+        order = shop.Order.query.filter_by(order_id=receipt).one()
+        return {'status': order.status, 'gateway_status': order.gateway_status,
+                'razorpay_order_id': order.razorpay_order_id, 'total': order.total}
+
+
+def start_checkout(client, quantity=2):
+    client.get('/api/clear-cart')  # carts are kept per user between tests
+    for _ in range(quantity):
+        client.get(f'/add-to-cart/{PRODUCT_ID}')
+    return client.post('/create-order').get_json()
+
+
+def test_create_order_opens_gateway_order(shop, client, gateway, sync_gateway):
+    before = stock(shop)
+
+    result = start_checkout(client)
+
+    assert result['success'], result
+    order = order_row(shop, result['receipt'])
+    assert order['status'] == 'Created'
+    assert order['gateway_status'] == 'ready'
+    assert result['order_id'] == order['razorpay_order_id']
+    assert gateway.orders[result['order_id']]['amount'] == int(order['total'] * 100)
+    assert stock(shop) == before - 2
+
+
+@pytest.mark.parametrize('failure', ['server_error', 'timeout'])
+def test_gateway_failure_releases_reservation(shop, client, gateway, sync_gateway, failure):
+    if failure == 'server_error':
+        gateway.fail_rate = 1.0
+    else:
+        gateway.delay = 1.0  # longer than RAZORPAY_READ_TIMEOUT
+    before = stock(shop)
+
+    result = start_checkout(client)
+
+    assert not result['success']
+    assert 'Payment gateway error' in result['message']
+    with shop.app.app_context():
+        order = shop.Order.query.order_by(shop.Order.id.desc()).first()
+        assert (order.status, order.gateway_status) == ('Cancelled', 'failed')
+    assert stock(shop) == before
+
+
+def test_async_order_is_polled_until_ready(shop, client, gateway):
+    gateway.delay = 0.2
+    before = stock(shop)
+
+    result = start_checkout(client)
+
+    assert result['success'] and result['pending']
+    deadline = time.monotonic() + 5
+    while result.get('pending'):
+        assert time.monotonic() < deadline, 'gateway order never became ready'
+        time.sleep(0.05)
+        result = client.get(result['status_url']).get_json()
+
+    assert result['success'], result
+    assert result['order_id'] in gateway.orders
+    assert order_row(shop, result['receipt'])['gateway_status'] == 'ready'
+    assert stock(shop) == before - 2
+
+
+def test_unpaid_order_is_released_when_its_hold_expires(shop, client, gateway, sync_gateway):
+    before = stock(shop)
+    scheduled = shop.task_queue.stats()['scheduled']
+
+    result = start_checkout(client)
+
+    assert result['success'], result
+    assert shop.task_queue.stats()['scheduled'] == scheduled + 1
+    with shop.app.app_context():
+        order = shop.Order.query.filter_by(order_id=result['receipt']).one()
+        shop.reservation_expired(order.id)  # hold not over yet: requeued, not released
+        assert order.status == 'Created'
+        order.reserved_until = shop.datetime.utcnow() - shop.timedelta(seconds=1)
+        shop.db.session.commit()
+        shop.reservation_expired(order.id)
+    assert order_row(shop, result['receipt'])['status'] == 'Cancelled'
+    assert stock(shop) == before
+
+
+def test_payment_after_expiry_sweep_does_not_oversell(shop, client, gateway, sync_gateway, monkeypatch):
+    def created_count():
+        with shop.app.app_context():
+            row = shop.db.session.get(shop.OrderStatusCount, 'Created')
+            return row.count if row else 0
+
+    before, created = stock(shop), created_count()
+    result = start_checkout(client)
+    assert result['success'], result
+    with shop.app.app_context():
+        order = shop.Order.query.filter_by(order_id=result['receipt']).one()
+        order.reserved_until = shop.datetime.utcnow() - shop.timedelta(seconds=1)
+        shop.db.session.commit()
+
+    # Let the sweep release the hold after payment_success has loaded the order
+    set_order_status = shop.set_order_status
+    def sweep_then_set(order, *args, **kwargs):
+        if not hasattr(sweep_then_set, 'swept'):
+            sweep_then_set.swept = True
+            def sweep():
+                with shop.app.app_context():
+                    shop.release_expired_reservations()
+            thread = threading.Thread(target=sweep)
+            thread.start()
+            thread.join()
+        return set_order_status(order, *args, **kwargs)
+    monkeypatch.setattr(shop, 'set_order_status', sweep_then_set)
+
+    client.post('/payment-success', data={'razorpay_order_id': result['order_id'],
+                                          'razorpay_payment_id': 'pay_race'})
+
+    assert order_row(shop, result['receipt'])['status'] == 'Paid'
+    assert stock(shop) == before - 2
+    assert created_count() == created
+
+
+def test_admin_cancelling_unpaid_order_returns_stock(shop, client, admin, gateway, sync_gateway):
+    before = stock(shop)
+    result = start_checkout(client)
+    assert result['success'], result
+
+    response = admin.post(f"/admin/update-order-status/{result['receipt']}", json={'status': 'Cancelled'})
+
+    assert response.get_json()['success']
+    order = order_row(shop, result['receipt'])
+    assert order['status'] == 'Cancelled'
+    assert stock(shop) == before
+
+
+def test_selling_out_and_restocking_bump_the_catalog_version(shop, client, gateway, sync_gateway):
+    def version():
+        with shop.app.app_context():
+            return shop.load_catalog_version().version
+
+    with shop.app.app_context():
+        product = shop.db.session.get(shop.Product, PRODUCT_ID)
+        original, product.stock = product.stock, 2
+        shop.db.session.commit()
+    try:
+        before = version()
+        result = start_checkout(client, quantity=2)
+        assert result['success'], result
+        sold_out = version()
+        assert sold_out > before
+
+        client.get(f"/payment-failed?order_id={result['receipt']}")
+        assert stock(shop) == 2
+        assert version() > sold_out
+    finally:
+        with shop.app.app_context():
+            shop.db.session.get(shop.Product, PRODUCT_ID).stock = original
+            shop.db.session.commit()
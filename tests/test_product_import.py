@@ -0,0 +1,56 @@
+"""Bulk product import: validation and updates keyed by sku"""
+import io
+
+import pytest
+
+
+def run_import(shop, text, fmt='csv'):
+    with shop.app.app_context():
+        return shop.import_products(io.StringIO(text), fmt)
+
+
+def product(shop, sku):
+    with shop.app.app_context():
+        row = shop.Product.query.filter_by(sku=sku).one()
+        shop.db.session.expunge(row)
+        return row
+
+
+@pytest.fixture
+def lamp(shop):
+    report = run_import(shop, 'sku,name,category,price,discount_price,stock,rating\n'
+                              'LAMP-1,Desk Lamp,Home,1000,900,77,4.9\n')
+    assert report.imported == 1, report.errors
+    return 'LAMP-1'
+
+
+def test_blank_cells_keep_the_current_values(shop, lamp):
+    report = run_import(shop, 'sku,name,category,price,discount_price,stock,rating\n'
+                              'LAMP-1,Desk Lamp,Home,1200,,,\n')
+
+    assert (report.updated, report.failed) == (1, 0), report.errors
+    row = product(shop, lamp)
+    assert (row.price, row.discount_price, row.stock, row.rating) == (1200, 900, 77, 4.9)
+    assert row.effective_price == 900
+
+
+def test_price_at_or_below_the_stored_discount_is_rejected(shop, lamp):
+    report = run_import(shop, 'sku,name,category,price\n'
+                              'LAMP-1,Desk Lamp,Home,800\n')
+
+    assert (report.updated, report.failed) == (0, 1)
+    assert 'discount_price' in report.errors[0][1]
+    assert product(shop, lamp).price == 1000
+
+
+def test_imported_rows_are_searchable_as_soon_as_they_commit(shop):
+    def search(word):
+        response = shop.app.test_client().get(f'/api/v1/products?search={word}')
+        return [item['name'] for item in response.get_json()['items']]
+
+    run_import(shop, '{"sku": "GLOBE-1", "name": "Zanzibar Globe", "category": "Home", "price": 2500}\n', 'jsonl')
+    assert search('zanzibar') == ['Zanzibar Globe']
+
+    run_import(shop, '{"sku": "GLOBE-1", "name": "Quixotic Globe", "category": "Home", "price": 2500}\n', 'jsonl')
+    assert search('zanzibar') == []
+    assert search('quixotic') == ['Quixotic Globe']